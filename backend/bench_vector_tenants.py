@@ -0,0 +1,73 @@
+import sys
+import time
+import tempfile
+import statistics
+
+import chromadb
+import numpy as np
+
+# Compares product search latency for one shared collection filtered by merchant_id (the old
+# layout) against one collection per merchant (vector_store.py), as the tenant count grows.
+# Uses random vectors in a throwaway Chroma directory, no OpenAI calls.
+#   python bench_vector_tenants.py [products_per_merchant] [tenant_counts] [queries]
+#   python bench_vector_tenants.py 500 1,10,50,200 200
+DIMENSIONS = 1536  # text-embedding-3-small
+BATCH_SIZE = 1000
+
+def _vectors(rng, count: int):
+    return rng.random((count, DIMENSIONS), dtype=np.float32)
+
+def _add(collection, ids: list, vectors, metadatas: list):
+    for start in range(0, len(ids), BATCH_SIZE):
+        end = start + BATCH_SIZE
+        collection.add(ids=ids[start:end], embeddings=vectors[start:end], metadatas=metadatas[start:end])
+
+def _measure(search, queries) -> tuple:
+    # Load every index once first, we compare steady-state searches, not cold starts
+    for merchant_id, vector in {merchant_id: vector for merchant_id, vector in queries}.items():
+        search(merchant_id, vector)
+    timings = []
+    for merchant_id, vector in queries:
+        started = time.perf_counter()
+        search(merchant_id, vector)
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return statistics.median(timings), timings[int(len(timings) * 0.95) - 1]
+
+def run(products_per_merchant: int, tenant_counts: list, total_queries: int):
+    rng = np.random.default_rng(7)
+    print(f"{products_per_merchant} products per merchant, {total_queries} searches, top 5\n")
+    print(f"{'tenants':>8} {'shared p50':>11} {'shared p95':>11} {'per-merchant p50':>17} {'per-merchant p95':>17}")
+
+    for tenants in tenant_counts:
+        with tempfile.TemporaryDirectory() as path:
+            client = chromadb.PersistentClient(path=path)
+            shared = client.create_collection("products", embedding_function=None)
+            per_merchant = {}
+            for m in range(tenants):
+                merchant_id = f"merchant-{m}"
+                ids = [f"{merchant_id}_sku-{i}" for i in range(products_per_merchant)]
+                metadatas = [{"merchant_id": merchant_id}] * products_per_merchant
+                vectors = _vectors(rng, products_per_merchant)
+                _add(shared, ids, vectors, metadatas)
+                per_merchant[merchant_id] = client.create_collection(f"products-{m}", embedding_function=None)
+                _add(per_merchant[merchant_id], ids, vectors, metadatas)
+
+            queries = [(f"merchant-{rng.integers(tenants)}", vector) for vector in _vectors(rng, total_queries)]
+            shared_p50, shared_p95 = _measure(
+                lambda merchant_id, vector: shared.query(
+                    query_embeddings=[vector], n_results=5, where={"merchant_id": merchant_id}
+                ),
+                queries
+            )
+            own_p50, own_p95 = _measure(
+                lambda merchant_id, vector: per_merchant[merchant_id].query(query_embeddings=[vector], n_results=5),
+                queries
+            )
+        print(f"{tenants:>8} {shared_p50:>9.2f}ms {shared_p95:>9.2f}ms {own_p50:>15.2f}ms {own_p95:>15.2f}ms")
+
+if __name__ == "__main__":
+    products = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    counts = [int(n) for n in sys.argv[2].split(",")] if len(sys.argv) > 2 else [1, 10, 50, 200]
+    queries = int(sys.argv[3]) if len(sys.argv) > 3 else 200
+    run(products, counts, queries)
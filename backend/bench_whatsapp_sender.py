@@ -0,0 +1,37 @@
+import os
+import sys
+import time
+import asyncio
+
+# Sends a burst of replies through whatsapp_sender against mock_graph_api.py and reports throughput.
+#   python mock_graph_api.py
+#   python bench_whatsapp_sender.py [messages] [phone_number_ids]
+os.environ.setdefault("WHATSAPP_GRAPH_API_URL", "http://localhost:8090/v21.0")
+
+import whatsapp_sender
+
+async def run(total_messages: int, phone_numbers: int):
+    started = time.perf_counter()
+    tasks = [
+        whatsapp_sender.send_whatsapp_message(
+            phone_number_id=f"mock-number-{i % phone_numbers}",
+            access_token="mock-token",
+            recipient_phone=f"92300{i:07d}",
+            text=f"Benchmark reply {i}"
+        )
+        for i in range(total_messages)
+    ]
+    results = await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+    await whatsapp_sender.close_client()
+
+    delivered = sum(1 for ok in results if ok)
+    print(f"\nSent {total_messages} messages over {phone_numbers} phone number ids in {elapsed:.2f}s")
+    print(f"Delivered: {delivered}, failed: {total_messages - delivered}")
+    print(f"Throughput: {total_messages / elapsed:.1f} msgs/sec "
+          f"(per-number concurrency {whatsapp_sender.MAX_CONCURRENCY_PER_NUMBER})")
+
+if __name__ == "__main__":
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    numbers = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    asyncio.run(run(total, numbers))
@@ -2,10 +2,15 @@ from langchain_openai import ChatOpenAI
 from langchain_core.messages import HumanMessage
 from langchain_community.callbacks.manager import get_openai_callback
 from langgraph.prebuilt import create_react_agent
-from langgraph.checkpoint.memory import MemorySaver
 from pydantic import BaseModel, Field
-from database import SessionLocal
-import models
+from cache import LRUCache
+from checkpointer import BoundedCheckpointer
+from merchant_cache import get_merchant_config
+from order_extraction import update_order_extraction
+from token_ledger import token_ledger
+from token_budget import make_budget_hook, estimate_fixed_tokens
+import os
+import asyncio
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -17,15 +22,17 @@ from tools import search_products, place_cod_order, update_delivery_address, can
 llm = ChatOpenAI(model="gpt-4o-mini", temperature=0)
 
 # 2. System Prompt
+# The store-specific parts (name, policies) come LAST: everything above them is identical for
+# every merchant, so OpenAI's prompt caching can reuse that prefix across stores and turns.
 def get_system_prompt(store_name: str, custom_policies: str) -> str:
-    store_context = f" representing {store_name}" if store_name else ""
+    store_context = f"- You are representing {store_name}.\n" if store_name else ""
     policies_text = custom_policies if custom_policies else """- Delivery Charges: 250 PKR
 - Free Delivery: Orders above 2999 PKR
 - Delivery Time: 3–4 days
 - Parcel Policy: Cannot open before payment
 - Payment: Cash on Delivery (COD)"""
 
-    return f"""You are a polite, smart, and friendly Female Customer Assistant for an E-commerce store on WhatsApp{store_context}.
+    return f"""You are a polite, smart, and friendly Female Customer Assistant for an E-commerce store on WhatsApp.
 Your job is to help customers find products and place orders in a smooth, natural conversation.
 
 You reply in Roman Urdu or English only (NO Hindi). **CRITICAL**: You MUST respond in the exact same language the user is speaking in. If they speak English, you MUST reply in English. If they speak Urdu/Roman Urdu, you MUST reply in Roman Urdu. Sound real, warm, and human, not robotic.
@@ -45,7 +52,7 @@ You reply in Roman Urdu or English only (NO Hindi). **CRITICAL**: You MUST respo
 
 2. Product Information
 - When a customer asks about a product, use the `search_products` tool.
-- Show only available products.
+- Show only available products: call `search_products` with `in_stock_only` set, and use `min_price`/`max_price` or `category` when the customer gives a budget or product type.
 - Use this exact format when showing results:
 - **CRITICAL RULE**: Do NOT show any product `[Image URL]` when listing multiple products. ONLY send the product's `[Image URL]` if the user explicitly asks to see a picture/image of a specific product.
 - Use the appropriate language depending on the user. For example, if displaying products:
@@ -89,55 +96,133 @@ Final Message after successful order MUST include the Order ID in the user's lan
 - If a customer wants to cancel an order, use the `cancel_order` tool. 
 - Always ask for the Order ID before modifying or canceling if you don't already know it from the chat history.
 
-💸 Policies & FAQs
-{policies_text}
 Greetings & Small Talk
 - If hello/hi/salam: Greet them in the same language. For example: "Aslam u Alaikum! 👋 Welcome to our store. How can I help you today?" or "Main apki kya madad kar sakti hoon?"
 - If how are you: Respond politely and ask how you can help in the same language.
+
+🏬 Store
+{store_context}
+💸 Policies & FAQs
+{policies_text}
 """
 
 # 3. Define Tools
 tools = [search_products, place_cod_order, update_delivery_address, cancel_order]
 
-# Memory for tracking session state (Using in-memory for now to get it running, can switch back to Mongo later if needed)
-memory = MemorySaver()
+# Memory for tracking session state: a bounded LRU of hot threads in memory, cold threads spilled to SQLite
+memory = BoundedCheckpointer()
 
-# Main entry point for the API
-async def process_chat_message(message: str, session_id: str, merchant_id: str):
+# 4. Order State Extraction
+class OrderExtractionState(BaseModel):
+    name: str = Field(description="Customer's explicit name, or 'Pending...' if unknown")
+    address: str = Field(description="Customer's explicit delivery address, or 'Pending...' if unknown")
+    phone: str = Field(description="Customer's explicit phone number, or 'Pending...' if unknown")
+    quantity: str = Field(description="Explicit quantity of items requested, or '—' if unknown")
+
+# The extraction schema does not depend on the merchant, so the structured runnable is built ONCE
+extraction_llm = llm.with_structured_output(OrderExtractionState)
+
+# ==========================================
+# Per-Merchant Agent Cache
+# ==========================================
+# Compiling the react agent graph (and rendering the ~1.5k token prompt) on every chat turn
+# costs CPU that the LLM call never needed. We keep one compiled agent per merchant and only
+# rebuild it when the store_name/system_prompt it was built from changes.
+AGENT_CACHE_SIZE = int(os.getenv("AGENT_CACHE_SIZE", "256"))
+_agent_cache = LRUCache(max_size=AGENT_CACHE_SIZE)
+
+def get_merchant_agent(merchant_id: str, store_name: str, custom_policies: str):
+    """
+    Returns the compiled agent for this merchant, building (and caching) it if the
+    cached one is missing or was built from different settings.
+    """
+    fingerprint = (store_name, custom_policies)
+    cached = _agent_cache.get(merchant_id)
+    if cached and cached[0] == fingerprint:
+        return cached[1]
+
+    system_prompt = get_system_prompt(store_name, custom_policies)
+    agent = create_react_agent(
+        llm,
+        tools,
+        prompt=system_prompt,
+        # Fits each model call into the per-turn token budget (token_budget.py)
+        pre_model_hook=make_budget_hook(estimate_fixed_tokens(system_prompt, tools)),
+        checkpointer=memory
+    )
+    _agent_cache.set(merchant_id, (fingerprint, agent))
+    return agent
+
+def invalidate_merchant_agent(merchant_id: str):
+    """Drops the cached agent so the next turn picks up new settings (called from PUT /settings)."""
+    _agent_cache.pop(merchant_id)
+
+async def _prepare_turn(session_id: str, merchant_id: str):
+    """Cached agent for the merchant plus the run config (and the lists the tools fill in)."""
     search_results = []
+    token_report = []
     config = {
         "configurable": {
             "thread_id": f"{merchant_id}:{session_id}",
             "merchant_id": merchant_id,
-            "search_results": search_results
+            "search_results": search_results,
+            "token_report": token_report
         }
     }
     
     # --- Dynamic Prompt Injection ---
-    db = SessionLocal()
     merchant = None
     try:
-        merchant = db.query(models.Merchant).filter(models.Merchant.merchant_id == merchant_id).first()
+        merchant = await get_merchant_config(merchant_id)
     except Exception as e:
         print(f"Error fetching merchant for prompt: {e}")
-    finally:
-        db.close()
 
     store_name = merchant.store_name if merchant and merchant.store_name else "our store"
     custom_policies = merchant.system_prompt if merchant and merchant.system_prompt else ""
-    dynamic_prompt = get_system_prompt(store_name, custom_policies)
         
-    # Re-create agent executor dynamically for this request to use the dynamic prompt
-    dynamic_agent_executor = create_react_agent(
-        llm, 
-        tools, 
-        prompt=dynamic_prompt,
-        checkpointer=memory
+    # Reuse the cached agent executor for this merchant's prompt
+    dynamic_agent_executor = get_merchant_agent(merchant_id, store_name, custom_policies)
+    return dynamic_agent_executor, config
+
+async def _conversation_history(dynamic_agent_executor, config: dict) -> list:
+    return (await dynamic_agent_executor.aget_state(config)).values.get("messages", [])
+
+async def _finish_turn(history: list, config: dict, merchant_id: str, cb):
+    """
+    Runs the order extraction for the finished turn and records its tokens.
+    Call inside the turn's get_openai_callback() block so the extraction call is counted too.
+    """
+    # --- Order State Extraction ---
+    # Incremental: deterministic parsers first, the extraction LLM only when new messages need it
+    order_extraction = await update_order_extraction(config["configurable"]["thread_id"], history, extraction_llm)
+        
+    # Track Tokens (buffered, flushed as atomic increments by the ledger)
+    token_ledger.record(merchant_id, cb.total_tokens)
+
+    # Actual usage from OpenAI plus the budget hook's estimate for each agent model call
+    token_report = config["configurable"]["token_report"]
+    token_usage = {
+        "prompt_tokens": cb.prompt_tokens,
+        "cached_prompt_tokens": cb.prompt_tokens_cached,
+        "completion_tokens": cb.completion_tokens,
+        "total_tokens": cb.total_tokens,
+        "model_calls": token_report
+    }
+    last_call = token_report[-1] if token_report else {}
+    print(
+        f"Turn tokens ({merchant_id}): prompt {cb.prompt_tokens} (cached {cb.prompt_tokens_cached}), "
+        f"completion {cb.completion_tokens}, {len(token_report)} agent calls, last call ~{last_call.get('estimated_input_tokens', 0)} "
+        f"input tokens ({last_call.get('messages_dropped', 0)} messages dropped)"
     )
+    return order_extraction, token_usage
+
+# Main entry point for the API
+async def process_chat_message(message: str, session_id: str, merchant_id: str):
+    dynamic_agent_executor, config = await _prepare_turn(session_id, merchant_id)
     
     with get_openai_callback() as cb:
-        # Run the agent
-        response = dynamic_agent_executor.invoke(
+        # Run the agent (async end to end, so a slow OpenAI call never blocks other merchants' turns)
+        response = await dynamic_agent_executor.ainvoke(
             {"messages": [HumanMessage(content=message)]},
             config
         )
@@ -145,47 +230,74 @@ async def process_chat_message(message: str, session_id: str, merchant_id: str):
         # Extract the last AI message
         ai_message = response["messages"][-1].content
         
-        # --- Order State Extraction ---
-        class OrderExtractionState(BaseModel):
-            name: str = Field(description="Customer's explicit name, or 'Pending...' if unknown")
-            address: str = Field(description="Customer's explicit delivery address, or 'Pending...' if unknown")
-            phone: str = Field(description="Customer's explicit phone number, or 'Pending...' if unknown")
-            quantity: str = Field(description="Explicit quantity of items requested, or '—' if unknown")
-
-        # Create a fast extraction LLM
-        extraction_llm = llm.with_structured_output(OrderExtractionState)
-        
         # Get the full conversation history to extract details
-        history = dynamic_agent_executor.get_state(config).values.get("messages", [])
-        
-        # Ask the LLM to extract the current known details
-        try:
-            extraction_prompt = f"Extract the current known customer order details from the conversation history. If a detail is missing, strictly use the default values 'Pending...' or '—' as defined in the schema.\n\nHistory: {[msg.content for msg in history[-10:]]}" # Look at last 10 messages for context
-            extracted_data = extraction_llm.invoke(extraction_prompt)
-            order_extraction = extracted_data.model_dump()
-        except Exception as e:
-            print(f"Extraction failed: {e}")
-            order_extraction = {"name": "Pending...", "address": "Pending...", "phone": "Pending...", "quantity": "—"}
-            
-        # Track Tokens
-        if cb.total_tokens > 0:
-            db = SessionLocal()
-            try:
-                merchant = db.query(models.Merchant).filter(models.Merchant.merchant_id == merchant_id).first()
-                if not merchant:
-                    merchant = models.Merchant(merchant_id=merchant_id)
-                    db.add(merchant)
-                
-                merchant.tokens_used += cb.total_tokens
-                db.commit()
-            except Exception as e:
-                db.rollback()
-                print(f"Failed to track tokens: {e}")
-            finally:
-                db.close()
-                
+        history = await _conversation_history(dynamic_agent_executor, config)
+        order_extraction, token_usage = await _finish_turn(history, config, merchant_id, cb)
+
     return {
         "response": ai_message,
-        "search_results": search_results,
-        "order_extraction": order_extraction
+        "search_results": config["configurable"]["search_results"],
+        "order_extraction": order_extraction,
+        "token_usage": token_usage
     }
+
+# Streamed turns run as tasks that outlive the request: if the client disconnects mid-reply, the
+# turn still finishes, so its tokens are recorded and its order details extracted. The set keeps
+# a reference until each task is done (the event loop only holds weak ones).
+_streamed_turns = set()
+_TURN_FAILED = object()
+
+async def _run_streamed_turn(dynamic_agent_executor, config: dict, message: str, merchant_id: str, queue: asyncio.Queue):
+    try:
+        with get_openai_callback() as cb:
+            async for event in dynamic_agent_executor.astream_events(
+                {"messages": [HumanMessage(content=message)]},
+                config,
+                version="v2"
+            ):
+                kind = event["event"]
+                if kind == "on_chat_model_stream" and event["metadata"].get("langgraph_node") == "agent":
+                    # Tool-call chunks carry no text, only the reply itself is streamed
+                    content = event["data"]["chunk"].content
+                    if isinstance(content, str) and content:
+                        queue.put_nowait(("token", {"content": content}))
+                elif kind == "on_tool_start":
+                    queue.put_nowait(("tool_start", {"run_id": event["run_id"], "name": event["name"], "input": event["data"].get("input")}))
+                elif kind == "on_tool_end":
+                    queue.put_nowait(("tool_end", {"run_id": event["run_id"], "name": event["name"]}))
+
+            history = await _conversation_history(dynamic_agent_executor, config)
+            ai_message = history[-1].content if history else ""
+            order_extraction, token_usage = await _finish_turn(history, config, merchant_id, cb)
+
+        queue.put_nowait(("done", {
+            "response": ai_message,
+            "search_results": config["configurable"]["search_results"],
+            "order_extraction": order_extraction,
+            "token_usage": token_usage
+        }))
+    except Exception as e:
+        queue.put_nowait((_TURN_FAILED, e))
+
+# Streaming entry point (POST /chat/stream)
+async def stream_chat_message(message: str, session_id: str, merchant_id: str):
+    """
+    Same turn as process_chat_message, as (event, data) pairs while the agent runs:
+    "token" for each reply chunk, "tool_start"/"tool_end" around tool calls, and "done"
+    with the full response, search_results, order_extraction and token_usage at the end.
+    Closing the generator early stops the stream, not the turn.
+    """
+    dynamic_agent_executor, config = await _prepare_turn(session_id, merchant_id)
+
+    queue = asyncio.Queue()
+    turn = asyncio.create_task(_run_streamed_turn(dynamic_agent_executor, config, message, merchant_id, queue))
+    _streamed_turns.add(turn)
+    turn.add_done_callback(_streamed_turns.discard)
+
+    while True:
+        event, data = await queue.get()
+        if event is _TURN_FAILED:
+            raise data
+        yield event, data
+        if event == "done":
+            return
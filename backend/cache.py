@@ -0,0 +1,76 @@
+import time
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    Small thread-safe least-recently-used cache.
+    Used for per-merchant objects that are expensive to build but cheap to keep around.
+    """
+
+    def __init__(self, max_size: int = 256):
+        self.max_size = max_size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            # Evict the least recently used entries (idle merchants) once we are over capacity
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            return self._data.pop(key, default)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._data
+
+
+class TTLCache:
+    """
+    Thread-safe cache whose entries expire `ttl_seconds` after they were set.
+    """
+
+    def __init__(self, ttl_seconds: float, max_size: int = 1024):
+        self.ttl_seconds = ttl_seconds
+        self._lru = LRUCache(max_size=max_size)
+
+    def get(self, key, default=None):
+        entry = self._lru.get(key)
+        if entry is None:
+            return default
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            self._lru.pop(key)
+            return default
+        return value
+
+    def set(self, key, value):
+        self._lru.set(key, (time.monotonic() + self.ttl_seconds, value))
+
+    def pop(self, key, default=None):
+        entry = self._lru.pop(key)
+        return entry[1] if entry is not None else default
+
+    def clear(self):
+        self._lru.clear()
@@ -0,0 +1,47 @@
+import hashlib
+
+from sqlalchemy import update, select
+
+from database import SessionLocal, AsyncSessionLocal
+import models
+
+# ==========================================
+# Per-Merchant Catalog Version
+# ==========================================
+# Every catalog write bumps the merchant's version, GET /products derives its ETag from it and
+# the lexical indexes rebuild when it moves (lexical_index.py).
+# An unchanged catalog can then be answered with 304 Not Modified after a single primary-key
+# lookup instead of the product query. The version is a column on merchants (not process
+# memory) so every uvicorn worker sees a bump made by any other one.
+
+def bump_catalog_version(merchant_id: str):
+    db = SessionLocal()
+    try:
+        db.execute(
+            update(models.Merchant)
+            .where(models.Merchant.merchant_id == merchant_id)
+            .values(catalog_version=models.Merchant.catalog_version + 1)
+        )
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        print(f"Failed to bump catalog version for {merchant_id}: {e}")
+    finally:
+        db.close()
+
+def catalog_version(db, merchant_id: str) -> int:
+    version = db.query(models.Merchant.catalog_version).filter(models.Merchant.merchant_id == merchant_id).scalar()
+    return version or 0
+
+async def load_catalog_version(merchant_id: str) -> int:
+    """catalog_version() for async callers, in its own session."""
+    async with AsyncSessionLocal() as db:
+        version = (await db.execute(
+            select(models.Merchant.catalog_version).where(models.Merchant.merchant_id == merchant_id)
+        )).scalar()
+    return version or 0
+
+def catalog_etag(db, merchant_id: str, *variant) -> str:
+    """Weak ETag for one view (page/fields) of a merchant's catalog at its current version."""
+    key = "|".join([merchant_id, str(catalog_version(db, merchant_id))] + [str(v) for v in variant])
+    return f'W/"{hashlib.sha1(key.encode()).hexdigest()}"'
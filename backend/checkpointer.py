@@ -0,0 +1,211 @@
+import os
+import time
+import pickle
+import sqlite3
+import threading
+from collections import OrderedDict, defaultdict
+
+from langgraph.checkpoint.memory import MemorySaver
+
+# ==========================================
+# Bounded, Persistent Conversation Checkpointer
+# ==========================================
+# MemorySaver keeps every conversation forever and loses all of them on restart. This saver keeps
+# the MemorySaver data layout for a bounded LRU of "hot" threads and spills the least recently
+# used ones to a local SQLite file. A spilled thread is transparently loaded back the next time
+# the customer writes. Threads idle for longer than the TTL are dropped from both tiers.
+# Hot threads are flushed to disk on shutdown (see close()).
+# Only the latest checkpoint of each (thread, namespace) is kept, with the channel blobs it
+# references and its pending writes: every step writes a checkpoint holding the whole message
+# history, and keeping the superseded ones grew each thread (and every spill) with every turn.
+CHECKPOINT_DB_PATH = os.getenv("CHECKPOINT_DB_PATH", "./checkpoints.sqlite")
+CHECKPOINT_HOT_THREADS = int(os.getenv("CHECKPOINT_HOT_THREADS", "2000"))
+CHECKPOINT_IDLE_TTL_SECONDS = float(os.getenv("CHECKPOINT_IDLE_TTL_SECONDS", str(7 * 24 * 3600)))
+# How often expired threads are swept out of memory and SQLite
+SWEEP_INTERVAL_SECONDS = 60
+
+class BoundedCheckpointer(MemorySaver):
+    def __init__(
+        self,
+        path: str = CHECKPOINT_DB_PATH,
+        max_hot_threads: int = CHECKPOINT_HOT_THREADS,
+        idle_ttl_seconds: float = CHECKPOINT_IDLE_TTL_SECONDS,
+        **kwargs
+    ):
+        super().__init__(**kwargs)
+        self.max_hot_threads = max_hot_threads
+        self.idle_ttl_seconds = idle_ttl_seconds
+        self._hot = OrderedDict()              # thread_id -> last access (wall clock), LRU order
+        self._write_keys = defaultdict(set)    # thread_id -> keys in self.writes
+        self._blob_keys = defaultdict(set)     # thread_id -> keys in self.blobs
+        self._lock = threading.RLock()
+        self._last_sweep = 0.0
+        self.stats = {"spilled": 0, "restored": 0, "expired": 0}
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS threads (thread_id TEXT PRIMARY KEY, payload BLOB NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_threads_last_access ON threads (last_access)")
+        self._conn.commit()
+
+    # --- Hot/cold bookkeeping ---
+
+    def _touch(self, thread_id: str):
+        with self._lock:
+            now = time.time()
+            if thread_id not in self._hot:
+                self._restore(thread_id)
+            self._hot[thread_id] = now
+            self._hot.move_to_end(thread_id)
+
+            while len(self._hot) > self.max_hot_threads:
+                cold_thread_id, last_access = self._hot.popitem(last=False)
+                self._spill(cold_thread_id, last_access)
+
+            if now - self._last_sweep > SWEEP_INTERVAL_SECONDS:
+                self._sweep(now)
+
+    def _forget(self, thread_id: str):
+        # Drops a thread from memory only (uses our key indexes instead of scanning every key)
+        self.storage.pop(thread_id, None)
+        for key in self._write_keys.pop(thread_id, ()):
+            self.writes.pop(key, None)
+        for key in self._blob_keys.pop(thread_id, ()):
+            self.blobs.pop(key, None)
+
+    def _prune(self, thread_id: str, checkpoint_ns: str, latest_id: str, channel_versions: dict):
+        # Drops the checkpoints `latest_id` supersedes, their pending writes and unreferenced blobs
+        checkpoints = self.storage[thread_id][checkpoint_ns]
+        for checkpoint_id in [checkpoint_id for checkpoint_id in checkpoints if checkpoint_id != latest_id]:
+            del checkpoints[checkpoint_id]
+        write_keys = self._write_keys[thread_id]
+        for key in [key for key in write_keys if key[1] == checkpoint_ns and key[2] != latest_id]:
+            self.writes.pop(key, None)
+            write_keys.discard(key)
+        blob_keys = self._blob_keys[thread_id]
+        for key in [key for key in blob_keys if key[1] == checkpoint_ns and channel_versions.get(key[2]) != key[3]]:
+            self.blobs.pop(key, None)
+            blob_keys.discard(key)
+
+    def _persist(self, thread_id: str, last_access: float):
+        storage = self.storage.get(thread_id)
+        if storage:
+            payload = pickle.dumps({
+                "storage": {ns: dict(checkpoints) for ns, checkpoints in storage.items()},
+                "writes": {key: self.writes[key] for key in self._write_keys.get(thread_id, ()) if key in self.writes},
+                "blobs": {key: self.blobs[key] for key in self._blob_keys.get(thread_id, ()) if key in self.blobs},
+            })
+            self._conn.execute(
+                "INSERT OR REPLACE INTO threads (thread_id, payload, last_access) VALUES (?, ?, ?)",
+                (thread_id, payload, last_access)
+            )
+            self._conn.commit()
+
+    def _spill(self, thread_id: str, last_access: float):
+        self._persist(thread_id, last_access)
+        self._forget(thread_id)
+        self.stats["spilled"] += 1
+
+    def _restore(self, thread_id: str):
+        row = self._conn.execute(
+            "SELECT payload, last_access FROM threads WHERE thread_id = ?", (thread_id,)
+        ).fetchone()
+        if not row:
+            return
+        if time.time() - row[1] > self.idle_ttl_seconds:
+            self._conn.execute("DELETE FROM threads WHERE thread_id = ?", (thread_id,))
+            self._conn.commit()
+            self.stats["expired"] += 1
+            return
+
+        data = pickle.loads(row[0])
+        for ns, checkpoints in data["storage"].items():
+            self.storage[thread_id][ns].update(checkpoints)
+        for key, value in data["writes"].items():
+            self.writes[key] = value
+            self._write_keys[thread_id].add(key)
+        for key, value in data["blobs"].items():
+            self.blobs[key] = value
+            self._blob_keys[thread_id].add(key)
+        # Threads spilled before pruning existed still hold every checkpoint
+        for ns, checkpoints in self.storage[thread_id].items():
+            if len(checkpoints) > 1:
+                latest_id = max(checkpoints)
+                channel_versions = self.serde.loads_typed(checkpoints[latest_id][0])["channel_versions"]
+                self._prune(thread_id, ns, latest_id, channel_versions)
+        self.stats["restored"] += 1
+
+    def _sweep(self, now: float):
+        self._last_sweep = now
+        cutoff = now - self.idle_ttl_seconds
+        # _hot is in access order, so expired threads are all at the front
+        while self._hot:
+            thread_id, last_access = next(iter(self._hot.items()))
+            if last_access >= cutoff:
+                break
+            self._hot.popitem(last=False)
+            self._forget(thread_id)
+            self.stats["expired"] += 1
+        deleted = self._conn.execute("DELETE FROM threads WHERE last_access < ?", (cutoff,)).rowcount
+        self._conn.commit()
+        self.stats["expired"] += max(deleted, 0)
+
+    def flush(self):
+        """Writes every hot thread to SQLite (keeps them in memory)."""
+        with self._lock:
+            for thread_id, last_access in self._hot.items():
+                self._persist(thread_id, last_access)
+
+    def close(self):
+        with self._lock:
+            self.flush()
+            self._conn.close()
+
+    # --- MemorySaver overrides (the async variants delegate to these) ---
+
+    def get_tuple(self, config):
+        with self._lock:
+            self._touch(config["configurable"]["thread_id"])
+            return super().get_tuple(config)
+
+    def list(self, config, **kwargs):
+        with self._lock:
+            if config:
+                self._touch(config["configurable"]["thread_id"])
+            # Materialize while holding the lock, eviction mutates the dicts we iterate
+            return iter(list(super().list(config, **kwargs)))
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        with self._lock:
+            thread_id = config["configurable"]["thread_id"]
+            self._touch(thread_id)
+            checkpoint_ns = config["configurable"]["checkpoint_ns"]
+            for channel, version in new_versions.items():
+                self._blob_keys[thread_id].add((thread_id, checkpoint_ns, channel, version))
+            result = super().put(config, checkpoint, metadata, new_versions)
+            # Checkpoint ids are time-ordered, a late put of an older one prunes nothing
+            if checkpoint["id"] == max(self.storage[thread_id][checkpoint_ns]):
+                self._prune(thread_id, checkpoint_ns, checkpoint["id"], checkpoint["channel_versions"])
+            return result
+
+    def put_writes(self, config, writes, task_id, task_path=""):
+        with self._lock:
+            thread_id = config["configurable"]["thread_id"]
+            self._touch(thread_id)
+            checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+            checkpoint_id = config["configurable"]["checkpoint_id"]
+            checkpoints = self.storage[thread_id][checkpoint_ns]
+            if checkpoints and checkpoint_id < max(checkpoints):
+                # Writes for a checkpoint that was already superseded would never be read
+                return
+            self._write_keys[thread_id].add((thread_id, checkpoint_ns, checkpoint_id))
+            return super().put_writes(config, writes, task_id, task_path)
+
+    def delete_thread(self, thread_id: str):
+        with self._lock:
+            self._hot.pop(thread_id, None)
+            self._forget(thread_id)
+            self._conn.execute("DELETE FROM threads WHERE thread_id = ?", (thread_id,))
+            self._conn.commit()
@@ -0,0 +1,71 @@
+import os
+import asyncio
+import traceback
+
+# ==========================================
+# Per-Conversation Ordered Work Queue
+# ==========================================
+# Customers often send 3-4 short WhatsApp messages in a row. Running one agent turn per message
+# makes the turns race on the same checkpointer thread and pays for a full agent turn each time.
+# Instead every (merchant_id, sender_phone) conversation gets ONE worker that waits for a short
+# quiet window, merges everything that arrived into a single turn, and processes turns strictly
+# in order. Messages that arrive while a turn is running are coalesced into the next one.
+DEBOUNCE_SECONDS = float(os.getenv("WHATSAPP_DEBOUNCE_SECONDS", "1.5"))
+# Upper bound on how long a burst can keep postponing its turn
+DEBOUNCE_MAX_WAIT_SECONDS = float(os.getenv("WHATSAPP_DEBOUNCE_MAX_WAIT_SECONDS", "6"))
+
+class ConversationQueue:
+    def __init__(self, handler, debounce_seconds: float = DEBOUNCE_SECONDS, max_wait_seconds: float = DEBOUNCE_MAX_WAIT_SECONDS):
+        # handler(key, messages) is awaited once per merged turn
+        self.handler = handler
+        self.debounce_seconds = debounce_seconds
+        self.max_wait_seconds = max_wait_seconds
+        self._pending = {}  # key -> [message text, ...]
+        self._wakeups = {}  # key -> asyncio.Event set on every new message
+        self._workers = {}  # key -> asyncio.Task (strong ref so it isn't garbage collected)
+        self.stats = {"messages": 0, "turns": 0}
+
+    def enqueue(self, key, text: str):
+        self._pending.setdefault(key, []).append(text)
+        self.stats["messages"] += 1
+
+        if key in self._workers:
+            # A worker already owns this conversation, just nudge its debounce timer
+            self._wakeups[key].set()
+            return
+
+        self._wakeups[key] = asyncio.Event()
+        self._workers[key] = asyncio.create_task(self._run(key))
+
+    async def _wait_for_quiet(self, key):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_wait_seconds
+        wakeup = self._wakeups[key]
+        while True:
+            wakeup.clear()
+            timeout = min(self.debounce_seconds, deadline - loop.time())
+            if timeout <= 0:
+                return
+            try:
+                await asyncio.wait_for(wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                return
+
+    async def _run(self, key):
+        try:
+            while self._pending.get(key):
+                await self._wait_for_quiet(key)
+                messages = self._pending.pop(key, [])
+                if not messages:
+                    continue
+                self.stats["turns"] += 1
+                try:
+                    await self.handler(key, messages)
+                except Exception:
+                    print(f"Error processing conversation turn for {key}:")
+                    traceback.print_exc()
+        finally:
+            # No await between the loop check above and this cleanup, so a message enqueued
+            # concurrently either lands before the check or starts a fresh worker.
+            self._workers.pop(key, None)
+            self._wakeups.pop(key, None)
@@ -0,0 +1,78 @@
+import os
+from datetime import date, timedelta
+
+from sqlalchemy import func, delete, case
+
+from cache import TTLCache
+from database import upsert
+import models
+
+# ==========================================
+# Dashboard Rollups & Response Cache
+# ==========================================
+# The dashboard used to count the orders table 9 times per refresh. Order writes now also bump a
+# tiny per-(merchant, day) rollup row in the same transaction, so the stats endpoint reads at most
+# 7 rollup rows for the chart plus one SUM for the total. On top of that a short-TTL per-merchant
+# response cache absorbs dashboard polling; order writes invalidate it explicitly.
+DASHBOARD_CACHE_TTL_SECONDS = float(os.getenv("DASHBOARD_CACHE_TTL_SECONDS", "15"))
+CANCELLED = "Cancelled"
+
+# Windows offered by the dashboard's top products panel (None = all time)
+TOP_PRODUCT_WINDOWS = {"24h": timedelta(hours=24), "7d": timedelta(days=7), "all": None}
+
+# Keyed by (merchant_id, top products window)
+dashboard_cache = TTLCache(ttl_seconds=DASHBOARD_CACHE_TTL_SECONDS)
+
+def invalidate_dashboard(merchant_id: str):
+    for window in TOP_PRODUCT_WINDOWS:
+        dashboard_cache.pop((merchant_id, window))
+
+def rollup_increment(merchant_id: str, day: date, orders: int = 0, revenue: float = 0.0, cancelled: int = 0):
+    """Atomic upsert statement adding the given deltas to a merchant's daily rollup row."""
+    return upsert(
+        models.DailyOrderRollup,
+        [{"merchant_id": merchant_id, "day": day, "orders": orders, "revenue": revenue, "cancelled": cancelled}],
+        ["merchant_id", "day"],
+        increment=("orders", "revenue", "cancelled")
+    )
+
+def order_day(order: models.Order) -> date:
+    # The date of the stored created_at (set by the DB), the same bucket func.date(created_at)
+    # gives backfill_order_rollups whatever the app server's time zone is
+    return order.created_at.date() if order.created_at else date.today()
+
+def status_change_rollup(order: models.Order, old_status: str, new_status: str):
+    """Rollup delta for an order status change, or None when the cancelled count is unaffected."""
+    if (old_status == CANCELLED) == (new_status == CANCELLED):
+        return None
+    delta = 1 if new_status == CANCELLED else -1
+    return rollup_increment(order.merchant_id, order_day(order), cancelled=delta)
+
+def backfill_order_rollups(db):
+    """
+    Rebuilds every rollup row from the orders table with one grouped aggregate.
+    Run once after creating the table (setup_db.py does this), or to repair drift.
+    """
+    order_date = func.date(models.Order.created_at)
+    rows = db.query(
+        models.Order.merchant_id,
+        order_date.label("day"),
+        func.count(models.Order.id).label("orders"),
+        func.coalesce(func.sum(models.Order.total_amount), 0).label("revenue"),
+        func.sum(case((models.Order.status == CANCELLED, 1), else_=0)).label("cancelled")
+    ).group_by(models.Order.merchant_id, order_date).all()
+
+    db.execute(delete(models.DailyOrderRollup))
+    if rows:
+        db.execute(models.DailyOrderRollup.__table__.insert(), [
+            {
+                "merchant_id": r.merchant_id,
+                "day": date.fromisoformat(str(r.day)),
+                "orders": r.orders,
+                "revenue": float(r.revenue or 0),
+                "cancelled": int(r.cancelled or 0)
+            }
+            for r in rows
+        ])
+    db.commit()
+    return len(rows)
@@ -1,6 +1,8 @@
 import os
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.dialects import mysql, sqlite
 from motor.motor_asyncio import AsyncIOMotorClient
 from dotenv import load_dotenv
 
@@ -23,6 +25,40 @@ def get_db():
     finally:
         db.close()
 
+# Async MySQL Setup (used by the chat/agent hot path so DB waits don't block the event loop)
+def _to_async_uri(uri: str) -> str:
+    # Same database, async driver: mysql+pymysql:// -> mysql+aiomysql://, sqlite:// -> sqlite+aiosqlite://
+    scheme, sep, rest = uri.partition("://")
+    dialect = scheme.split("+")[0]
+    driver = {"mysql": "aiomysql", "sqlite": "aiosqlite"}.get(dialect)
+    return f"{dialect}+{driver}{sep}{rest}" if driver else uri
+
+MYSQL_ASYNC_URI = os.getenv("MYSQL_ASYNC_URI") or _to_async_uri(MYSQL_URI)
+async_engine = create_async_engine(
+    MYSQL_ASYNC_URI,
+    pool_pre_ping=True,
+    pool_recycle=3600,
+)
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
+
+def upsert(model, rows: list, conflict_columns: list, increment: tuple = (), replace: tuple = ()):
+    """
+    Builds a multi-row INSERT ... ON DUPLICATE KEY UPDATE for `model`.
+    Columns in `increment` are added to the existing value atomically (col = col + new),
+    columns in `replace` are overwritten. `conflict_columns` must be covered by a unique key
+    (MySQL/TiDB infer it, SQLite needs it spelled out for local development).
+    """
+    if engine.dialect.name == "sqlite":
+        stmt = sqlite.insert(model).values(rows)
+        changes = {col: getattr(model, col) + stmt.excluded[col] for col in increment}
+        changes.update({col: stmt.excluded[col] for col in replace})
+        return stmt.on_conflict_do_update(index_elements=conflict_columns, set_=changes)
+
+    stmt = mysql.insert(model).values(rows)
+    changes = {col: getattr(model, col) + stmt.inserted[col] for col in increment}
+    changes.update({col: stmt.inserted[col] for col in replace})
+    return stmt.on_duplicate_key_update(**changes)
+
 # MongoDB Setup
 MONGO_URI = os.getenv("MONGO_URI")
 client = AsyncIOMotorClient(MONGO_URI)
@@ -0,0 +1,107 @@
+import os
+import re
+import time
+import sqlite3
+import threading
+from array import array
+
+from cache import LRUCache
+
+# ==========================================
+# Two-Tier Query Embedding Cache
+# ==========================================
+# Customers keep asking the same things ("shoes", "price?", a product name the agent searches
+# again two turns later), and each search_products call used to pay an OpenAI round trip for
+# the query embedding. Embeddings are now cached by (model, normalized query):
+#   1. an in-process LRU for the hot queries
+#   2. a local SQLite file that survives restarts (float32 blobs, oldest rows pruned past a cap)
+EMBEDDING_CACHE_DB_PATH = os.getenv("EMBEDDING_CACHE_DB_PATH", "./embedding_cache.sqlite")
+EMBEDDING_CACHE_MEMORY_SIZE = int(os.getenv("EMBEDDING_CACHE_MEMORY_SIZE", "5000"))
+EMBEDDING_CACHE_DISK_MAX_ROWS = int(os.getenv("EMBEDDING_CACHE_DISK_MAX_ROWS", "200000"))
+# How many new rows are written between checks of the disk cap
+PRUNE_EVERY_WRITES = 1000
+
+_WHITESPACE = re.compile(r"\s+")
+
+def normalize_query(text: str) -> str:
+    return _WHITESPACE.sub(" ", text).strip().lower()
+
+class QueryEmbeddingCache:
+    def __init__(
+        self,
+        embeddings,
+        path: str = EMBEDDING_CACHE_DB_PATH,
+        memory_size: int = EMBEDDING_CACHE_MEMORY_SIZE,
+        disk_max_rows: int = EMBEDDING_CACHE_DISK_MAX_ROWS
+    ):
+        self.embeddings = embeddings
+        self.model = getattr(embeddings, "model", type(embeddings).__name__)
+        self.disk_max_rows = disk_max_rows
+        self._memory = LRUCache(max_size=memory_size)
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS query_embeddings ("
+            "model TEXT NOT NULL, query TEXT NOT NULL, vector BLOB NOT NULL, created_at REAL NOT NULL, "
+            "PRIMARY KEY (model, query))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_query_embeddings_created_at ON query_embeddings (created_at)")
+        self._conn.commit()
+
+    def _load(self, query: str):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT vector FROM query_embeddings WHERE model = ? AND query = ?", (self.model, query)
+            ).fetchone()
+        if not row:
+            return None
+        return array("f", row[0]).tolist()
+
+    def _save(self, query: str, vector: list):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO query_embeddings (model, query, vector, created_at) VALUES (?, ?, ?, ?)",
+                (self.model, query, array("f", vector).tobytes(), time.time())
+            )
+            self._writes += 1
+            if self._writes % PRUNE_EVERY_WRITES == 0:
+                # Keep the newest disk_max_rows rows
+                self._conn.execute(
+                    "DELETE FROM query_embeddings WHERE created_at < ("
+                    "SELECT created_at FROM query_embeddings ORDER BY created_at DESC LIMIT 1 OFFSET ?)",
+                    (self.disk_max_rows,)
+                )
+            self._conn.commit()
+
+    async def aembed_query(self, text: str) -> list:
+        query = normalize_query(text)
+
+        vector = self._memory.get(query)
+        if vector is not None:
+            self.stats["memory_hits"] += 1
+            return vector
+
+        vector = self._load(query)
+        if vector is not None:
+            self.stats["disk_hits"] += 1
+            self._memory.set(query, vector)
+            return vector
+
+        self.stats["misses"] += 1
+        vector = await self.embeddings.aembed_query(query)
+        self._memory.set(query, vector)
+        self._save(query, vector)
+        return vector
+
+    def hit_rate(self) -> float:
+        hits = self.stats["memory_hits"] + self.stats["disk_hits"]
+        total = hits + self.stats["misses"]
+        return hits / total if total else 0.0
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
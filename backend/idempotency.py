@@ -0,0 +1,70 @@
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import delete
+from sqlalchemy.exc import IntegrityError
+
+from database import AsyncSessionLocal
+import models
+
+# ==========================================
+# Inbound Message De-duplication
+# ==========================================
+# Meta re-delivers webhook events when our ack is slow. Every WhatsApp message carries a stable
+# `id` (wamid...), so we "claim" it once and drop any later delivery of the same id before it
+# costs an agent turn or a second reply. The in-memory store is always consulted first; set
+# WHATSAPP_DEDUP_BACKEND=db to also persist claims so they survive restarts / multiple workers.
+DEDUP_BACKEND = os.getenv("WHATSAPP_DEDUP_BACKEND", "memory").lower()
+DEDUP_TTL_SECONDS = float(os.getenv("WHATSAPP_DEDUP_TTL_SECONDS", str(24 * 3600)))
+# How many DB claims between purges of expired rows
+DB_PURGE_EVERY = 1000
+
+_seen = OrderedDict()  # message_id -> expires_at (insertion order == expiry order, TTL is constant)
+_db_claims = 0
+
+def _purge_memory(now: float):
+    while _seen:
+        if next(iter(_seen.values())) > now:
+            break
+        _seen.popitem(last=False)
+
+async def _claim_in_db(message_id: str) -> bool:
+    global _db_claims
+    async with AsyncSessionLocal() as db:
+        try:
+            db.add(models.ProcessedMessage(message_id=message_id))
+            await db.commit()
+        except IntegrityError:
+            await db.rollback()
+            return False
+
+        _db_claims += 1
+        if _db_claims % DB_PURGE_EVERY == 0:
+            cutoff = datetime.now(timezone.utc) - timedelta(seconds=DEDUP_TTL_SECONDS)
+            await db.execute(delete(models.ProcessedMessage).where(models.ProcessedMessage.created_at < cutoff))
+            await db.commit()
+    return True
+
+async def claim_message(message_id: str) -> bool:
+    """
+    Returns True the first time a WhatsApp message id is seen, False for duplicate deliveries.
+    """
+    if not message_id:
+        # Nothing to de-duplicate on, let it through
+        return True
+
+    now = time.monotonic()
+    _purge_memory(now)
+    if message_id in _seen:
+        return False
+    _seen[message_id] = now + DEDUP_TTL_SECONDS
+
+    if DEDUP_BACKEND == "db":
+        try:
+            return await _claim_in_db(message_id)
+        except Exception as e:
+            # Fail open, a rare duplicate reply beats dropping a customer's message
+            print(f"Warning: DB de-duplication failed, falling back to memory: {e}")
+    return True
@@ -0,0 +1,138 @@
+import os
+import time
+import uuid
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from database import SessionLocal
+from ingest_products import process_shopify_csv
+from dashboard_stats import invalidate_dashboard
+
+# ==========================================
+# Background Catalog Ingestion Jobs
+# ==========================================
+# A big Shopify export takes minutes to parse, write and embed, far longer than an HTTP request
+# should stay open. /upload-catalog now streams the file to disk, submits a job to this worker
+# pool and returns the job id; the dashboard polls GET /upload-catalog/{job_id} for progress.
+# Jobs live in process memory and finished ones are forgotten after JOB_RETENTION_SECONDS.
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+JOB_RETENTION_SECONDS = float(os.getenv("INGEST_JOB_RETENTION_SECONDS", "3600"))
+
+# Share of the progress bar each phase covers ("importing" is the pipelined write + embed of all chunks)
+PHASE_SPAN = {
+    "queued": (0, 0),
+    "parsing": (0, 5),
+    "importing": (5, 95),
+    "cleanup": (95, 99),
+    "done": (100, 100),
+}
+
+_executor = ThreadPoolExecutor(max_workers=INGEST_WORKERS, thread_name_prefix="catalog-ingest")
+_jobs = {}
+_lock = threading.Lock()
+
+class IngestJob:
+    def __init__(self, merchant_id: str, filename: str):
+        self.job_id = uuid.uuid4().hex
+        self.merchant_id = merchant_id
+        self.filename = filename
+        self.status = "queued"  # queued, running, succeeded, failed
+        self.phase = "queued"
+        self.rows_done = 0
+        self.rows_total = 0
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self._phase_started = time.monotonic()
+
+    def report(self, phase: str, done: int, total: int):
+        # Called from the worker thread by process_shopify_csv
+        if phase != self.phase:
+            self.phase = phase
+            self._phase_started = time.monotonic()
+        self.rows_done = done
+        self.rows_total = total
+
+    def eta_seconds(self):
+        """Time left in the current phase, extrapolated from its rate so far."""
+        if self.status != "running" or not self.rows_done or self.rows_done >= self.rows_total:
+            return None
+        elapsed = time.monotonic() - self._phase_started
+        return round(elapsed / self.rows_done * (self.rows_total - self.rows_done), 1)
+
+    def percent(self) -> int:
+        start, end = PHASE_SPAN.get(self.phase, (0, 0))
+        fraction = self.rows_done / self.rows_total if self.rows_total else 0
+        return int(start + (end - start) * fraction)
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.job_id,
+            "filename": self.filename,
+            "status": self.status,
+            "phase": self.phase,
+            "rows_processed": self.rows_done,
+            "rows_total": self.rows_total,
+            "percent": self.percent(),
+            "eta_seconds": self.eta_seconds(),
+            "result": self.result,
+            "error": self.error,
+        }
+
+def _prune():
+    cutoff = time.time() - JOB_RETENTION_SECONDS
+    with _lock:
+        for job_id in [job_id for job_id, job in _jobs.items() if job.finished_at and job.finished_at < cutoff]:
+            del _jobs[job_id]
+
+def _run(job: IngestJob, file_path: str):
+    job.status = "running"
+    try:
+        result = process_shopify_csv(file_path, job.merchant_id, progress=job.report)
+
+        from models import ActivityLog
+        db = SessionLocal()
+        try:
+            db.add(ActivityLog(
+                merchant_id=job.merchant_id,
+                action_text=f"New product catalog synced ({result['processed']} items)",
+                action_type="info"
+            ))
+            db.commit()
+        finally:
+            db.close()
+        invalidate_dashboard(job.merchant_id)
+
+        job.result = result
+        job.status = "succeeded"
+        job.report("done", result["processed"], result["processed"])
+    except Exception as e:
+        traceback.print_exc()
+        job.error = str(e)
+        job.status = "failed"
+    finally:
+        job.finished_at = time.time()
+        if os.path.exists(file_path):
+            os.remove(file_path)
+
+def submit_ingest_job(merchant_id: str, file_path: str, filename: str) -> IngestJob:
+    """Queues `file_path` for ingestion; the file is deleted when the job finishes."""
+    _prune()
+    job = IngestJob(merchant_id, filename)
+    with _lock:
+        _jobs[job.job_id] = job
+    _executor.submit(_run, job, file_path)
+    return job
+
+def get_ingest_job(job_id: str, merchant_id: str):
+    with _lock:
+        job = _jobs.get(job_id)
+    # Never reveal another merchant's job
+    if job is None or job.merchant_id != merchant_id:
+        return None
+    return job
+
+def shutdown_ingest_workers():
+    _executor.shutdown(wait=False, cancel_futures=True)
@@ -1,8 +1,13 @@
+import os
+import time
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
-from database import SessionLocal
+from database import SessionLocal, upsert
 from models import Product, Merchant
-from langchain_openai import OpenAIEmbeddings
-from langchain_chroma import Chroma
+from vector_store import vector_store, normalize_category
+from catalog_version import bump_catalog_version
+from lexical_index import lexical_indexes, LexicalDoc
 
 # Allowable columns per specification
 ALLOWED_COLUMNS = [
@@ -18,28 +23,111 @@ ALLOWED_COLUMNS = [
 # Columns that Shopify leaves blank for variants that we should forward-fill
 FFILL_COLUMNS = ["Title", "Body (HTML)", "Description", "Vendor", "Custom Product Type", "Tags", "SEO Description", "Image Src", "Status", "Published", "Image URL 1", "Image URL 2", "Image URL 3", "Image URL 4", "Image URL 5"]
 
-embedding_model = OpenAIEmbeddings(model="text-embedding-3-small")
-vectorstore = Chroma(
-    collection_name="products",
-    embedding_function=embedding_model,
-    persist_directory="./chroma_db"
-)
+# Product columns written by the bulk upsert, and the ones refreshed when the SKU already exists
+PRODUCT_COLUMNS = [
+    "merchant_id", "handle", "sku", "title", "description", "price", "image_url_1", "image_url_2",
+    "image_url_3", "image_url_4", "image_url_5", "vendor", "instock", "inventory_policy"
+]
+PRODUCT_UPDATE_COLUMNS = tuple(col for col in PRODUCT_COLUMNS if col not in ("merchant_id", "sku"))
+UPSERT_CHUNK_SIZE = int(os.getenv("INGEST_UPSERT_CHUNK_SIZE", "1000"))
+# Rows parsed per CSV chunk; bounds ingest memory regardless of the export size
+CSV_CHUNK_ROWS = int(os.getenv("INGEST_CSV_CHUNK_ROWS", "5000"))
+
+def _no_progress(phase: str, done: int, total: int):
+    pass
 
-def process_shopify_csv(file_path: str, merchant_id: str) -> int:
+def process_shopify_csv(file_path: str, merchant_id: str, progress=None) -> dict:
     """
-    Parses a Shopify CSV, cleans it, and inserts valid variants into MySQL and ChromaDB.
-    Returns the number of variants processed.
+    Parses a Shopify CSV, cleans it, and upserts valid variants into MySQL and ChromaDB.
+    The file is streamed in Handle-aligned chunks: while one chunk is written to MySQL and
+    embedded, the next one is parsed, so memory stays bounded by the chunk size.
+    Returns ingest stats: processed/inserted/updated variants and rows per second.
+    `progress(phase, done, total)` is called as each phase advances (see ingest_jobs.py).
     """
+    progress = progress or _no_progress
+    started = time.perf_counter()
+    progress("parsing", 0, 0)
+
+    db = None
     try:
-        # 1. Read the CSV
-        df = pd.read_csv(file_path)
+        from sqlalchemy import text
+        _tmp_db = SessionLocal()
+        _tmp_db.execute(text("SELECT 1"))
+        db = _tmp_db
     except Exception as e:
-        raise ValueError(f"Failed to read CSV: {str(e)}")
+        print(f"Warning: MySQL connection failed, proceeding with ChromaDB only. Error: {e}")
+
+    store = _ChunkStore(db, merchant_id)
+    file_size = max(os.path.getsize(file_path), 1)
+
+    try:
+        with open(file_path, "rb") as handle, ThreadPoolExecutor(max_workers=1, thread_name_prefix="catalog-store") as writer:
+            pending = None
+            try:
+                for chunk in _iter_handle_chunks(handle):
+                    variants = _build_variants(_clean_chunk(chunk), merchant_id)
+                    # At most one chunk is stored while the next one is parsed
+                    if pending:
+                        pending.result()
+                    # Rows seen so far scaled by bytes read gives a running estimate of the total
+                    bytes_read = max(handle.tell(), 1)
+                    pending = writer.submit(store.store, variants, lambda done, bytes_read=bytes_read: progress(
+                        "importing", done, max(done, int(done * file_size / bytes_read))
+                    ))
+            finally:
+                if pending:
+                    pending.result()
+
+        # --- Cleanup: vectors of products that no longer exist ---
+        progress("cleanup", store.result["processed"], store.result["processed"])
+        store.finish()
+            
+    except Exception as e:
+        if db:
+            db.rollback()
+        raise e
+    finally:
+        if db:
+            db.close()
 
-    # Keep only allowed columns if they exist in the file
-    available_columns = [col for col in ALLOWED_COLUMNS if col in df.columns]
-    df = df[available_columns]
+    result = store.result
+    elapsed = time.perf_counter() - started
+    result["seconds"] = round(elapsed, 3)
+    result["rows_per_sec"] = round(result["processed"] / elapsed, 1) if elapsed > 0 else None
+    result["db_rows_per_sec"] = round(result["processed"] / store.db_seconds, 1) if store.db_seconds > 0 else None
+    print(f"Catalog ingest for {merchant_id}: {result}")
+    return result
 
+def _iter_handle_chunks(handle):
+    """
+    Yields DataFrames of about CSV_CHUNK_ROWS rows. The rows of the last Handle in a chunk are
+    held back for the next one, so a product and its variants always land in the same chunk.
+    """
+    try:
+        # dtype=str keeps each column's parsing identical in every chunk (e.g. numeric SKUs)
+        reader = pd.read_csv(handle, chunksize=CSV_CHUNK_ROWS, dtype=str, usecols=lambda col: col in ALLOWED_COLUMNS)
+        carry = None
+        for chunk in reader:
+            # We strictly need a Variant SKU and Variant Price to represent a sellable item
+            if "Variant SKU" not in chunk.columns or "Variant Price" not in chunk.columns:
+                raise ValueError("CSV is missing required 'Variant SKU' or 'Variant Price' columns.")
+            if carry is not None:
+                chunk = pd.concat([carry, chunk], ignore_index=True)
+            if "Handle" not in chunk.columns:
+                yield chunk
+                continue
+            # Trailing run of rows sharing the chunk's last Handle
+            is_last_handle = chunk["Handle"] == chunk["Handle"].iloc[-1]
+            in_tail = is_last_handle[::-1].cummin()[::-1]
+            carry = chunk[in_tail]
+            if not in_tail.all():
+                yield chunk[~in_tail]
+        if carry is not None and len(carry):
+            yield carry
+    except (pd.errors.ParserError, pd.errors.EmptyDataError, UnicodeDecodeError) as e:
+        raise ValueError(f"Failed to read CSV: {str(e)}")
+
+def _clean_chunk(df: pd.DataFrame) -> pd.DataFrame:
     # 2. Handle Parent/Child Variants (Forward Fill)
     # Group by Handle and ffill the top-level parent data down to the variants
     if "Handle" in df.columns:
@@ -55,147 +143,258 @@ def process_shopify_csv(file_path: str, merchant_id: str) -> int:
         df = df[df["Status"].str.lower() == "active"]
     if "Published" in df.columns:
         df = df[df["Published"].astype(str).str.upper() == "TRUE"]
-        
-    # We strictly need a Variant SKU and Variant Price to represent a sellable item
-    if "Variant SKU" not in df.columns or "Variant Price" not in df.columns:
-        raise ValueError("CSV is missing required 'Variant SKU' or 'Variant Price' columns.")
 
     df = df[df["Variant SKU"] != ""]
     
     # Ensure price is float
-    df["Variant Price"] = pd.to_numeric(df["Variant Price"], errors="coerce").fillna(0.0)
+    df = df.assign(**{"Variant Price": pd.to_numeric(df["Variant Price"], errors="coerce").fillna(0.0)})
 
-    db = None
-    try:
-        from sqlalchemy import text
-        _tmp_db = SessionLocal()
-        _tmp_db.execute(text("SELECT 1"))
-        db = _tmp_db
-    except Exception as e:
-        print(f"Warning: MySQL connection failed, proceeding with ChromaDB only. Error: {e}")
-    processed_count = 0
-    
-    docs_to_embed = []
-    metadatas = []
-    ids = []
+    # A SKU appearing twice would be written twice, the last row wins like it did row by row
+    return df.drop_duplicates(subset="Variant SKU", keep="last")
 
-    try:
-        # --- Ensure Merchant Exists ---
-        if db:
-            existing_merchant = db.query(Merchant).filter(Merchant.merchant_id == merchant_id).first()
-            if not existing_merchant:
-                # Provide a generic store name or scrape from Shopify vendor if needed
-                fallback_store_name = df["Vendor"].iloc[0] if "Vendor" in df.columns and len(df) > 0 else "My Store"
-                new_merchant = Merchant(
-                    merchant_id=merchant_id,
-                    store_name=fallback_store_name
-                )
-                db.add(new_merchant)
-                db.flush() # Commit this early so products don't fail
-
-        for _, row in df.iterrows():
-            handle = str(row.get("Handle", ""))
-            sku = str(row.get("Variant SKU", ""))
-            title = str(row.get("Title", ""))
-            price = float(row.get("Variant Price", 0.0))
-            vendor = str(row.get("Vendor", ""))
-            img1 = str(row.get("Image URL 1", "")) or str(row.get("Variant Image", "")) or str(row.get("Image Src", ""))
-            img2 = str(row.get("Image URL 2", ""))
-            img3 = str(row.get("Image URL 3", ""))
-            img4 = str(row.get("Image URL 4", ""))
-            img5 = str(row.get("Image URL 5", ""))
-            desc = str(row.get("Description", "")) or str(row.get("Body (HTML)", "")) or str(row.get("SEO Description", ""))
-            
-            raw_qty = str(row.get("Variant Inventory Qty", "")).strip()
-            instock = int(float(raw_qty)) if raw_qty else 0
-            
-            inv_policy = str(row.get("Variant Inventory Policy", ""))
-            cat = str(row.get("Custom Product Type", ""))
-            tags = str(row.get("Tags", ""))
-            
-            # Options
-            opt1n, opt1v = str(row.get("Option1 Name", "")), str(row.get("Option1 Value", ""))
-            opt2n, opt2v = str(row.get("Option2 Name", "")), str(row.get("Option2 Value", ""))
-            opt3n, opt3v = str(row.get("Option3 Name", "")), str(row.get("Option3 Value", ""))
-
-            # --- MySQL Storage (Upsert) ---
-            if db:
-                existing_product = db.query(Product).filter(
-                    Product.merchant_id == merchant_id, 
-                    Product.sku == sku
-                ).first()
-
-                if existing_product:
-                    existing_product.handle = handle
-                    existing_product.title = title
-                    existing_product.description = desc
-                    existing_product.price = price
-                    existing_product.image_url_1 = img1
-                    existing_product.image_url_2 = img2
-                    existing_product.image_url_3 = img3
-                    existing_product.image_url_4 = img4
-                    existing_product.image_url_5 = img5
-                    existing_product.vendor = vendor
-                    existing_product.instock = instock
-                    existing_product.inventory_policy = inv_policy
-                else:
-                    new_product = Product(
-                        merchant_id=merchant_id,
-                        handle=handle,
-                        sku=sku,
-                        title=title,
-                        description=desc,
-                        price=price,
-                        image_url_1=img1,
-                        image_url_2=img2,
-                        image_url_3=img3,
-                        image_url_4=img4,
-                        image_url_5=img5,
-                        vendor=vendor,
-                        instock=instock,
-                        inventory_policy=inv_policy
-                    )
-                    db.add(new_product)
-
-            # --- ChromaDB Storage ---
-            opts = []
-            if opt1n and opt1v: opts.append(f"{opt1n}: {opt1v}")
-            if opt2n and opt2v: opts.append(f"{opt2n}: {opt2v}")
-            if opt3n and opt3v: opts.append(f"{opt3n}: {opt3v}")
-            options_text = ", ".join(opts)
-
-            doc_text = f"Product: {title} ({sku}). Category: {cat}. Tags: {tags}. Description: {desc}. Options: {options_text}. Price: {price}. In Stock: {instock}. Inventory Policy: {inv_policy}."
-            
-            docs_to_embed.append(doc_text)
-            metadatas.append({
-                "merchant_id": merchant_id, # Strict clerk isolation
-                "sku": sku,
-                "handle": handle,
-                "price": price,
-                "inventory_policy": inv_policy
-            })
-            ids.append(f"{merchant_id}_{sku}")
-            
-            processed_count += 1
+class _ChunkStore:
+    """
+    Writes parsed chunks to MySQL and Chroma, one at a time on the pipeline's store thread.
+    """
 
-        if db:
-            db.commit()
-        
-        # Batch upsert to Chroma to prevent rate limiting
-        if docs_to_embed:
-            # Add to ChromaDB
-            vectorstore.add_texts(
-                texts=docs_to_embed,
-                metadatas=metadatas,
-                ids=ids
+    def __init__(self, db, merchant_id: str):
+        self.db = db
+        self.merchant_id = merchant_id
+        self.result = {
+            "processed": 0, "inserted": 0, "updated": 0,
+            "embedded": 0, "metadata_updated": 0, "skipped": 0, "deleted": 0, "chunks": 0
+        }
+        self.db_seconds = 0.0
+        # Every SKU MySQL holds for this merchant, grows as chunks are written (None without a DB)
+        self.known_skus = None
+
+    def _ensure_merchant(self, variants: pd.DataFrame):
+        # --- Ensure Merchant Exists ---
+        existing_merchant = self.db.query(Merchant).filter(Merchant.merchant_id == self.merchant_id).first()
+        if not existing_merchant:
+            # Provide a generic store name or scrape from Shopify vendor if needed
+            fallback_store_name = variants["vendor"].iloc[0] if len(variants) and variants["vendor"].iloc[0] else "My Store"
+            new_merchant = Merchant(
+                merchant_id=self.merchant_id,
+                store_name=fallback_store_name
             )
-            
-    except Exception as e:
-        if db:
-            db.rollback()
-        raise e
-    finally:
-        if db:
-            db.close()
+            self.db.add(new_merchant)
+            self.db.flush() # Commit this early so products don't fail
+
+    def store(self, variants: pd.DataFrame, report):
+        if not len(variants):
+            return
+        if self.db:
+            db_started = time.perf_counter()
+            if self.known_skus is None:
+                self._ensure_merchant(variants)
+                # One query for every SKU this merchant already has (instead of a SELECT per row)
+                self.known_skus = {sku for (sku,) in self.db.query(Product.sku).filter(Product.merchant_id == self.merchant_id)}
+
+            # --- MySQL Storage (chunked multi-row upsert) ---
+            counts = _bulk_upsert_products(self.db, self.merchant_id, variants, self.known_skus)
+            self.db.commit()
+            self.known_skus.update(variants["sku"])
+            self.db_seconds += time.perf_counter() - db_started
+            self.result["inserted"] += counts["inserted"]
+            self.result["updated"] += counts["updated"]
+        bump_catalog_version(self.merchant_id)
+
+        # --- ChromaDB Storage ---
+        # Only re-embed documents whose content changed (see _sync_vectors)
+        for key, count in _sync_vectors(self.merchant_id, variants).items():
+            self.result[key] += count
+        lexical_indexes.upsert(self.merchant_id, [
+            LexicalDoc(row.sku, row.title, row.handle, row.tags, row.options)
+            for row in variants.itertuples(index=False)
+        ])
+
+        self.result["processed"] += len(variants)
+        self.result["chunks"] += 1
+        report(self.result["processed"])
+
+    def finish(self):
+        if self.known_skus is not None:
+            self.result["deleted"] = _delete_orphan_vectors(self.merchant_id, self.known_skus)
+            if self.result["deleted"]:
+                lexical_indexes.invalidate(self.merchant_id)
+
+def _content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def _column(df: pd.DataFrame, name: str) -> pd.Series:
+    # Missing optional columns behave like a column of empty strings
+    if name in df.columns:
+        return df[name].astype(str)
+    return pd.Series("", index=df.index, dtype=object)
+
+def _first_non_empty(*series: pd.Series) -> pd.Series:
+    result = series[0]
+    for fallback in series[1:]:
+        result = result.where(result != "", fallback)
+    return result
+
+def product_embed_hash(title: str, sku: str, product_type: str, tags: str, description: str, options: str) -> str:
+    # Hash of the parts that give the embedding its meaning. Price, stock and inventory policy are
+    # left out on purpose: a change to those only refreshes the stored document and metadata.
+    return _content_hash("\x1f".join([title, sku, product_type, tags, description, options]))
+
+def product_document(title: str, sku: str, product_type: str, tags: str, description: str, options: str,
+                     price: float, instock: int, inventory_policy: str) -> str:
+    """The text embedded for one variant. Used by the ingest and by the single-product endpoints."""
+    return (
+        f"Product: {title} ({sku}). Category: {product_type}. Tags: {tags}. Description: {description}. "
+        f"Options: {options}. Price: {price}. In Stock: {instock}. Inventory Policy: {inventory_policy}."
+    )
+
+def _build_variants(df: pd.DataFrame, merchant_id: str) -> pd.DataFrame:
+    """
+    Builds one row per sellable variant with the Product columns plus the embedding doc_text,
+    using whole-column pandas operations.
+    """
+    variants = pd.DataFrame({
+        "merchant_id": merchant_id,
+        "handle": _column(df, "Handle"),
+        "sku": _column(df, "Variant SKU"),
+        "title": _column(df, "Title"),
+        "description": _first_non_empty(_column(df, "Description"), _column(df, "Body (HTML)"), _column(df, "SEO Description")),
+        "price": df["Variant Price"].astype(float),
+        "image_url_1": _first_non_empty(_column(df, "Image URL 1"), _column(df, "Variant Image"), _column(df, "Image Src")),
+        "image_url_2": _column(df, "Image URL 2"),
+        "image_url_3": _column(df, "Image URL 3"),
+        "image_url_4": _column(df, "Image URL 4"),
+        "image_url_5": _column(df, "Image URL 5"),
+        "vendor": _column(df, "Vendor"),
+        "instock": pd.to_numeric(_column(df, "Variant Inventory Qty").str.strip(), errors="coerce").fillna(0).astype(int),
+        "inventory_policy": _column(df, "Variant Inventory Policy"),
+    }, index=df.index)
+
+    # Options: "Name: Value" pairs joined by ", ", skipping incomplete pairs
+    options_text = pd.Series("", index=df.index, dtype=object)
+    for i in (1, 2, 3):
+        name, value = _column(df, f"Option{i} Name"), _column(df, f"Option{i} Value")
+        options_text += (name + ": " + value + ", ").where((name != "") & (value != ""), "")
+    options_text = options_text.str.replace(r", $", "", regex=True)
+    # Kept in the Chroma metadata for the lexical index (lexical_index.py), and with the product
+    # type so a single-product edit can rebuild the same document and embed_hash (sync_product_vector)
+    variants["tags"] = _column(df, "Tags")
+    variants["options"] = options_text
+    variants["product_type"] = _column(df, "Custom Product Type")
+    # Filterable by search_products, with the stock and price already in the metadata
+    variants["category"] = variants["product_type"].map(normalize_category)
+
+    columns = zip(variants["title"], variants["sku"], variants["product_type"], variants["tags"], variants["description"], options_text)
+    variants["embed_hash"] = [product_embed_hash(*parts) for parts in columns]
+    columns = zip(
+        variants["title"], variants["sku"], variants["product_type"], variants["tags"], variants["description"],
+        options_text, variants["price"], variants["instock"], variants["inventory_policy"]
+    )
+    variants["doc_text"] = [product_document(*parts) for parts in columns]
+    return variants.reset_index(drop=True)
+
+def _bulk_upsert_products(db, merchant_id: str, variants: pd.DataFrame, existing_skus: set) -> dict:
+    """
+    Writes variants with chunked multi-row INSERT ... ON DUPLICATE KEY UPDATE
+    (relies on the (merchant_id, sku) unique key). `existing_skus` is prefetched in one query.
+    """
+    inserted = int((~variants["sku"].isin(existing_skus)).sum())
+
+    rows = variants[PRODUCT_COLUMNS].to_dict("records")
+    for start in range(0, len(rows), UPSERT_CHUNK_SIZE):
+        db.execute(upsert(Product, rows[start:start + UPSERT_CHUNK_SIZE], ["merchant_id", "sku"], replace=PRODUCT_UPDATE_COLUMNS))
+
+    return {"inserted": inserted, "updated": len(rows) - inserted}
+
+def _sync_vectors(merchant_id: str, variants: pd.DataFrame) -> dict:
+    """
+    Brings the Chroma documents of `variants` in line without paying for embeddings that
+    would not change:
+      - new SKUs, or SKUs whose embed_hash changed, are embedded
+      - SKUs whose document or metadata changed otherwise are rewritten with their stored embedding
+      - unchanged SKUs are skipped
+    """
+    stored = vector_store.get(merchant_id, variants["sku"].tolist(), include=("documents", "metadatas"))
+
+    to_embed, to_refresh = [], []
+    skipped = 0
+    for row in variants.itertuples(index=False):
+        metadata = {
+            "merchant_id": merchant_id, # Strict clerk isolation
+            "sku": row.sku,
+            "handle": row.handle,
+            "price": row.price,
+            "instock": int(row.instock),
+            "inventory_policy": row.inventory_policy,
+            "category": row.category,
+            "tags": row.tags,
+            "options": row.options,
+            "product_type": row.product_type,
+            "embed_hash": row.embed_hash
+        }
+        previous = stored.get(row.sku)
+        if previous is None or (previous["metadata"] or {}).get("embed_hash") != row.embed_hash:
+            to_embed.append((row.sku, row.doc_text, metadata))
+        elif previous["document"] != row.doc_text or previous["metadata"] != metadata:
+            to_refresh.append((row.sku, row.doc_text, metadata))
+        else:
+            skipped += 1
+
+    if to_embed:
+        vector_store.add_texts(
+            merchant_id,
+            [sku for sku, _, _ in to_embed],
+            [doc for _, doc, _ in to_embed],
+            [metadata for _, _, metadata in to_embed]
+        )
+
+    if to_refresh:
+        # Re-use the stored vectors instead of embedding the new text again
+        skus = [sku for sku, _, _ in to_refresh]
+        stored_embeddings = vector_store.get(merchant_id, skus, include=("embeddings",))
+        vector_store.upsert(
+            merchant_id,
+            skus,
+            [doc for _, doc, _ in to_refresh],
+            [metadata for _, _, metadata in to_refresh],
+            [stored_embeddings[sku]["embedding"] for sku in skus]
+        )
+
+    return {"embedded": len(to_embed), "metadata_updated": len(to_refresh), "skipped": skipped}
+
+def sync_product_vector(merchant_id: str, product: Product, product_type: str = None) -> dict:
+    """
+    Writes one product edited through the API with the same document and metadata the ingest
+    builds. Tags and options only come from the CSV, so they are kept from the stored record, as
+    is the product type (and with it the category) unless `product_type` is given. The stored
+    embedding is re-used when the embed_hash did not change.
+    """
+    stored = vector_store.get(merchant_id, [product.sku]).get(product.sku)
+    previous = (stored or {}).get("metadata") or {}
+    tags, options = previous.get("tags", ""), previous.get("options", "")
+    if product_type is None:
+        # Vectors ingested before product_type was stored only have the normalized category
+        product_type = previous.get("product_type", previous.get("category", ""))
+    instock = int(product.instock or 0)
+    variant = {
+        "sku": product.sku,
+        "handle": product.handle,
+        "price": product.price,
+        "instock": instock,
+        "inventory_policy": product.inventory_policy,
+        "category": normalize_category(product_type),
+        "tags": tags,
+        "options": options,
+        "product_type": product_type,
+        "embed_hash": product_embed_hash(product.title, product.sku, product_type, tags, product.description or "", options),
+        "doc_text": product_document(
+            product.title, product.sku, product_type, tags, product.description or "", options,
+            product.price, instock, product.inventory_policy
+        )
+    }
+    return _sync_vectors(merchant_id, pd.DataFrame([variant]))
 
-    return processed_count
+def _delete_orphan_vectors(merchant_id: str, known_skus: set) -> int:
+    """Deletes the merchant's vectors whose SKU no longer exists in MySQL."""
+    orphan_skus = [sku for sku in vector_store.get(merchant_id, include=()) if sku not in known_skus]
+    vector_store.delete(merchant_id, orphan_skus)
+    return len(orphan_skus)
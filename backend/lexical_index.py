@@ -0,0 +1,270 @@
+import os
+import re
+import math
+import asyncio
+import threading
+from collections import Counter, defaultdict
+
+from sqlalchemy import select
+
+from cache import LRUCache
+from catalog_version import load_catalog_version
+from database import AsyncSessionLocal
+from vector_store import vector_store, normalize_category
+import models
+
+# ==========================================
+# Per-Merchant Lexical (BM25) Product Index
+# ==========================================
+# Customers often type an exact product name or SKU. Embedding that and running an ANN query
+# costs a round trip and can rank the exact product below look-alikes. Each merchant gets an
+# in-process inverted index over title, SKU, handle, tags and options:
+#   - an exact SKU / title match, or a clear BM25 winner, is answered without any embedding
+#   - otherwise BM25 and vector rankings are fused with reciprocal rank fusion (RRF)
+# Indexes are built lazily from the products table (plus tags/options stored in the Chroma
+# metadata by the catalog ingest) and kept current by the product write paths of this process.
+# Writes made by other workers are picked up through the merchant's catalog_version: an index
+# built at an older version is rebuilt on the next search. A build also
+# fills in the search filter metadata that older vectors lack (_backfill_filter_metadata).
+LEXICAL_INDEX_MERCHANTS = int(os.getenv("LEXICAL_INDEX_MERCHANTS", "200"))
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Title and SKU tokens count this many times, they identify a product far better than tags
+STRONG_FIELD_WEIGHT = 2
+# The top hit must beat the runner-up by this factor to skip the vector search
+CONFIDENCE_MARGIN = 1.5
+RRF_K = 60
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+# "Product: Title (SKU). Category: Running Shoes. Tags: ..." (older documents go straight to Description)
+_DOC_CATEGORY = re.compile(r"\)\. Category: (.*?)\. (?:Tags|Description): ")
+
+def tokenize(text: str) -> list:
+    return _TOKEN.findall((text or "").lower())
+
+def _title_key(text: str) -> str:
+    return " ".join(tokenize(text))
+
+class LexicalDoc:
+    __slots__ = ("sku", "title", "handle", "tags", "options")
+
+    def __init__(self, sku: str, title: str = "", handle: str = "", tags=None, options=None):
+        self.sku = sku
+        self.title = title or ""
+        self.handle = handle or ""
+        # None means "keep what the index already has" on upsert
+        self.tags = tags
+        self.options = options
+
+class LexicalIndex:
+    """BM25 index over one merchant's catalog. Safe to update from the ingest threads."""
+
+    def __init__(self):
+        self._docs = {}                       # sku -> LexicalDoc
+        self._lengths = {}                    # sku -> weighted token count
+        self._postings = defaultdict(dict)    # term -> {sku: weighted tf}
+        self._strong_terms = {}               # sku -> set of title/SKU tokens
+        self._by_sku = {}                     # lowercased sku -> sku
+        self._by_title = defaultdict(set)     # normalized title -> skus
+        self._total_length = 0
+        self._lock = threading.Lock()
+        self.catalog_version = None           # merchant's catalog_version when built
+
+    def __len__(self):
+        return len(self._docs)
+
+    def _remove(self, sku: str):
+        doc = self._docs.pop(sku, None)
+        if doc is None:
+            return
+        for term in self._postings_terms(doc):
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(sku, None)
+                if not postings:
+                    del self._postings[term]
+        self._total_length -= self._lengths.pop(sku, 0)
+        self._strong_terms.pop(sku, None)
+        self._by_sku.pop(sku.lower(), None)
+        titled = self._by_title.get(_title_key(doc.title))
+        if titled is not None:
+            titled.discard(sku)
+            if not titled:
+                del self._by_title[_title_key(doc.title)]
+
+    def _postings_terms(self, doc: LexicalDoc) -> Counter:
+        strong = tokenize(doc.title) + tokenize(doc.sku) + [doc.sku.lower()]
+        weak = tokenize(doc.handle) + tokenize(doc.tags) + tokenize(doc.options)
+        terms = Counter(weak)
+        for term in strong:
+            terms[term] += STRONG_FIELD_WEIGHT
+        return terms
+
+    def upsert(self, doc: LexicalDoc):
+        with self._lock:
+            previous = self._docs.get(doc.sku)
+            if previous is not None:
+                if doc.tags is None:
+                    doc.tags = previous.tags
+                if doc.options is None:
+                    doc.options = previous.options
+                self._remove(doc.sku)
+            doc.tags = doc.tags or ""
+            doc.options = doc.options or ""
+
+            terms = self._postings_terms(doc)
+            for term, tf in terms.items():
+                self._postings[term][doc.sku] = tf
+            length = sum(terms.values())
+            self._docs[doc.sku] = doc
+            self._lengths[doc.sku] = length
+            self._total_length += length
+            self._strong_terms[doc.sku] = set(tokenize(doc.title) + tokenize(doc.sku))
+            self._by_sku[doc.sku.lower()] = doc.sku
+            self._by_title[_title_key(doc.title)].add(doc.sku)
+
+    def remove(self, sku: str):
+        with self._lock:
+            self._remove(sku)
+
+    def get(self, sku: str):
+        with self._lock:
+            return self._docs.get(sku)
+
+    def exact_matches(self, query: str) -> list:
+        """SKUs whose SKU or full title equals the query (case and punctuation insensitive)."""
+        with self._lock:
+            sku = self._by_sku.get(query.strip().lower())
+            if sku is not None:
+                return [sku]
+            key = _title_key(query)
+            return sorted(self._by_title.get(key, ())) if key else []
+
+    def search(self, query: str, limit: int) -> list:
+        """Top `limit` (sku, bm25 score) pairs, best first."""
+        terms = set(tokenize(query)) | {query.strip().lower()}
+        with self._lock:
+            if not self._docs:
+                return []
+            doc_count = len(self._docs)
+            avg_length = self._total_length / doc_count
+            scores = defaultdict(float)
+            for term in terms:
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (doc_count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for sku, tf in postings.items():
+                    norm = BM25_K1 * (1 - BM25_B + BM25_B * self._lengths[sku] / avg_length)
+                    scores[sku] += idf * tf * (BM25_K1 + 1) / (tf + norm)
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:limit]
+
+    def is_confident(self, query: str, hits: list) -> bool:
+        """
+        True when the top hit contains every query word in its title/SKU and clearly
+        outscores the runner-up, so the vector search would not change the answer.
+        """
+        query_terms = set(tokenize(query))
+        if not hits or not query_terms:
+            return False
+        with self._lock:
+            strong_terms = self._strong_terms.get(hits[0][0], set())
+        if not query_terms <= strong_terms:
+            return False
+        return len(hits) == 1 or hits[0][1] >= CONFIDENCE_MARGIN * hits[1][1]
+
+def reciprocal_rank_fusion(*rankings, k: int = RRF_K) -> list:
+    """Fuses ranked lists of keys into one list of (key, score), best first."""
+    scores = defaultdict(float)
+    for ranking in rankings:
+        for rank, key in enumerate(ranking):
+            scores[key] += 1.0 / (k + rank + 1)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+def _backfill_filter_metadata(merchant_id: str, rows: list, extras: dict) -> int:
+    """
+    Vectors written before search_products had filters (or copied as they were by
+    migrate_vector_collections.py) carry no stock, price or category metadata, so Chroma's
+    `where` would drop them from every filtered search. Fills those fields in from the products
+    table, and the category from the stored document, the first time the merchant is searched.
+    Returns how many records were updated.
+    """
+    products = {sku: (price, instock, policy) for sku, _, _, price, instock, policy in rows}
+    stale = [sku for sku, meta in extras.items() if sku in products and ("instock" not in meta or "category" not in meta)]
+    if not stale:
+        return 0
+    documents = vector_store.get(merchant_id, stale, include=("documents",))
+    metadatas = []
+    for sku in stale:
+        price, instock, policy = products[sku]
+        match = _DOC_CATEGORY.search((documents.get(sku) or {}).get("document") or "")
+        filled = {
+            "price": float(price or 0),
+            "instock": int(instock or 0),
+            "inventory_policy": policy or "",
+            "category": normalize_category(match.group(1)) if match else ""
+        }
+        # Fields the record already has win
+        extras[sku] = {**filled, **extras[sku]}
+        metadatas.append(extras[sku])
+    vector_store.update_metadata(merchant_id, stale, metadatas)
+    print(f"Backfilled search filter metadata for {len(stale)} vectors of {merchant_id}")
+    return len(stale)
+
+class LexicalIndexRegistry:
+    def __init__(self, max_merchants: int = LEXICAL_INDEX_MERCHANTS):
+        self._indexes = LRUCache(max_size=max_merchants)
+        self._build_locks = defaultdict(asyncio.Lock)
+
+    async def get(self, merchant_id: str) -> LexicalIndex:
+        # Read before any build, so a write landing during the build triggers another one
+        version = await load_catalog_version(merchant_id)
+        index = self._indexes.get(merchant_id)
+        if index is not None and index.catalog_version == version:
+            return index
+        # One build per merchant even if several searches arrive together
+        async with self._build_locks[merchant_id]:
+            index = self._indexes.get(merchant_id)
+            if index is None or index.catalog_version != version:
+                index = await self._build(merchant_id)
+                index.catalog_version = version
+                self._indexes.set(merchant_id, index)
+        self._build_locks.pop(merchant_id, None)
+        return index
+
+    async def _build(self, merchant_id: str) -> LexicalIndex:
+        async with AsyncSessionLocal() as db:
+            rows = (await db.execute(
+                select(
+                    models.Product.sku, models.Product.title, models.Product.handle,
+                    models.Product.price, models.Product.instock, models.Product.inventory_policy
+                ).where(models.Product.merchant_id == merchant_id)
+            )).all()
+        # Tags and options only live in the ingested documents' metadata
+        stored = await asyncio.to_thread(vector_store.get, merchant_id)
+        extras = {sku: record["metadata"] or {} for sku, record in stored.items()}
+        await asyncio.to_thread(_backfill_filter_metadata, merchant_id, rows, extras)
+
+        index = LexicalIndex()
+        for sku, title, handle, *_ in rows:
+            meta = extras.get(sku, {})
+            index.upsert(LexicalDoc(sku, title, handle, meta.get("tags", ""), meta.get("options", "")))
+        return index
+
+    def upsert(self, merchant_id: str, docs):
+        # Nothing to do if the merchant's index is not loaded, it is built fresh on first search
+        index = self._indexes.get(merchant_id)
+        if index is not None:
+            for doc in docs:
+                index.upsert(doc)
+
+    def remove(self, merchant_id: str, skus):
+        index = self._indexes.get(merchant_id)
+        if index is not None:
+            for sku in skus:
+                index.remove(sku)
+
+    def invalidate(self, merchant_id: str):
+        self._indexes.pop(merchant_id)
+
+lexical_indexes = LexicalIndexRegistry()
@@ -1,5 +1,5 @@
-from fastapi import FastAPI, HTTPException, Depends, UploadFile, File
-from fastapi.responses import FileResponse
+from fastapi import FastAPI, HTTPException, Depends, UploadFile, File, Request, Response
+from fastapi.responses import FileResponse, StreamingResponse
 import os
 import uuid
 import random
@@ -8,13 +8,24 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
 import uvicorn
-from brain import process_chat_message
+from brain import process_chat_message, stream_chat_message, invalidate_merchant_agent, memory as conversation_memory
+from merchant_cache import invalidate_merchant
 from auth import get_current_merchant
-from ingest_products import process_shopify_csv
+from ingest_jobs import submit_ingest_job, get_ingest_job, shutdown_ingest_workers
 from database import get_db
 from whatsapp import router as whatsapp_router
-from sqlalchemy.orm import Session
-from models import Product, Order, Customer, OrderItem
+from whatsapp_sender import close_client as close_whatsapp_client
+from tools import query_embeddings
+from lexical_index import lexical_indexes, LexicalDoc
+from vector_store import vector_store
+from ingest_products import sync_product_vector
+from token_ledger import token_ledger
+from query_log import product_query_counter, top_queried_products
+from catalog_version import bump_catalog_version, catalog_etag
+from dashboard_stats import dashboard_cache, invalidate_dashboard, status_change_rollup, TOP_PRODUCT_WINDOWS
+from sqlalchemy.orm import Session, joinedload, selectinload
+from pagination import NEXT_CURSOR_HEADER, encode_cursor, decode_cursor, clamp_page_size
+from models import Product, Order
 
 from typing import Optional
 
@@ -26,6 +37,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER, "ETag"],
 )
 
 app.include_router(whatsapp_router, prefix="/webhook/whatsapp")
@@ -33,6 +45,27 @@ app.include_router(whatsapp_router, prefix="/webhook/whatsapp")
 os.makedirs("uploads", exist_ok=True)
 app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
 
+@app.on_event("startup")
+async def startup_event():
+    # Background flusher for buffered token usage
+    token_ledger.start()
+    # Background flusher for buffered product query counts
+    product_query_counter.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    # Write out usage that has not been flushed yet
+    await token_ledger.stop()
+    await product_query_counter.stop()
+    # Close the pooled keep-alive connections to the Graph API
+    await close_whatsapp_client()
+    # Persist the hot conversation threads so they survive the restart
+    conversation_memory.close()
+    # Drop catalog imports that have not started yet
+    shutdown_ingest_workers()
+    print(f"Query embedding cache: {query_embeddings.stats}")
+    query_embeddings.close()
+
 class ChatRequest(BaseModel):
     message: str
     session_id: str
@@ -62,6 +95,7 @@ def get_settings(merchant_id: str = Depends(get_current_merchant), db: Session =
             import secrets
             merchant.webhook_verify_token = secrets.token_hex(16)
             db.commit()
+            invalidate_merchant(merchant_id)
 
         return {
             "store_name": merchant.store_name or "",
@@ -96,6 +130,10 @@ def update_settings(payload: SettingsUpdate, merchant_id: str = Depends(get_curr
         merchant.webhook_verify_token = payload.webhook_verify_token
         
         db.commit()
+
+        # Cached config snapshots and the cached agent were built from the old settings
+        invalidate_merchant(merchant_id)
+        invalidate_merchant_agent(merchant_id)
         return {"status": "success", "message": "Settings updated"}
     except Exception as e:
         db.rollback()
@@ -114,6 +152,34 @@ async def chat_endpoint(request: ChatRequest, merchant_id: str = Depends(get_cur
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/chat/stream")
+async def chat_stream_endpoint(request: ChatRequest, merchant_id: str = Depends(get_current_merchant)):
+    """
+    Server-Sent Events version of /chat: the reply is streamed token by token (`token`),
+    tool calls are announced (`tool_start` / `tool_end`) and the final `done` event carries
+    the same payload /chat returns. Failures mid-stream arrive as an `error` event.
+    """
+    import json
+
+    def sse(event: str, data: dict) -> str:
+        return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+    async def events():
+        try:
+            async for event, data in stream_chat_message(request.message, request.session_id, merchant_id):
+                yield sse(event, data)
+        except Exception as e:
+            import traceback
+            traceback.print_exc()
+            yield sse("error", {"detail": str(e)})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        # Keep proxies (nginx, ngrok) from buffering the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.get("/settings/webhook-url")
 def get_webhook_url(merchant_id: str = Depends(get_current_merchant)):
     import requests
@@ -128,11 +194,69 @@ def get_webhook_url(merchant_id: str = Depends(get_current_merchant)):
     except Exception:
         return {"url": "Ngrok tunnel not detected"}
 
+PRODUCTS_PAGE_SIZE = 200
+PRODUCTS_MAX_PAGE_SIZE = 1000
+
+# Output field -> (columns it needs, formatter). Only the requested columns are selected.
+PRODUCT_FIELDS = {
+    "id": ([Product.id], lambda p: p.id),
+    "sku": ([Product.sku], lambda p: p.sku),
+    "title": ([Product.title], lambda p: p.title),
+    "handle": ([Product.handle], lambda p: p.handle),
+    "vendor": ([Product.vendor], lambda p: p.vendor),
+    "price": ([Product.price], lambda p: f"Rs. {p.price}"),
+    "description": ([Product.description, Product.handle], lambda p: str(p.description if p.description else p.handle)),
+    "stock": ([Product.instock], lambda p: (p.instock or 0) > 0),
+    "instock": ([Product.instock], lambda p: p.instock or 0),
+    "inventory_policy": ([Product.inventory_policy], lambda p: p.inventory_policy),
+    "image_url_1": ([Product.image_url_1], lambda p: p.image_url_1),
+}
+DEFAULT_PRODUCT_FIELDS = ["id", "sku", "title", "price", "description", "stock", "instock", "inventory_policy"]
+
 @app.get("/products")
-def get_products(merchant_id: str = Depends(get_current_merchant), db: Session = Depends(get_db)):
+def get_products(
+    request: Request,
+    response: Response,
+    limit: int = PRODUCTS_PAGE_SIZE,
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    merchant_id: str = Depends(get_current_merchant),
+    db: Session = Depends(get_db)
+):
     try:
-        products = db.query(Product).filter(Product.merchant_id == merchant_id).all()
-        return [{"id": p.id, "sku": p.sku, "title": p.title, "price": f"Rs. {p.price}", "description": str(p.description if hasattr(p, 'description') and p.description else p.handle), "stock": p.instock > 0 if hasattr(p, 'instock') else True, "instock": p.instock if hasattr(p, 'instock') else 0, "inventory_policy": p.inventory_policy} for p in products]
+        limit = clamp_page_size(limit, PRODUCTS_MAX_PAGE_SIZE)
+        selected = [f.strip() for f in fields.split(",") if f.strip()] if fields else DEFAULT_PRODUCT_FIELDS
+        unknown = [f for f in selected if f not in PRODUCT_FIELDS]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown product fields: {', '.join(unknown)}")
+
+        # Unchanged catalog -> 304 after one primary-key lookup, without the product query
+        etag = catalog_etag(db, merchant_id, limit, cursor, ",".join(selected))
+        response.headers["ETag"] = etag
+        response.headers["Cache-Control"] = "private, no-cache"
+        if request.headers.get("if-none-match") == etag:
+            return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "private, no-cache"})
+
+        columns = {Product.id}
+        for field in selected:
+            columns.update(PRODUCT_FIELDS[field][0])
+
+        query = db.query(*sorted(columns, key=lambda c: c.key)).filter(Product.merchant_id == merchant_id)
+        if cursor:
+            try:
+                after_id = int(decode_cursor(cursor)[0])
+            except (ValueError, IndexError, TypeError):
+                raise HTTPException(status_code=400, detail="Invalid pagination cursor")
+            query = query.filter(Product.id > after_id)
+
+        products = query.order_by(Product.id).limit(limit + 1).all()
+        if len(products) > limit:
+            products = products[:limit]
+            response.headers[NEXT_CURSOR_HEADER] = encode_cursor(products[-1].id)
+
+        return [{field: PRODUCT_FIELDS[field][1](p) for field in selected} for p in products]
+    except HTTPException:
+        raise
     except Exception as e:
         import traceback
         traceback.print_exc()
@@ -176,6 +300,8 @@ class EditProductInput(BaseModel):
     vendor: Optional[str] = ""
     instock: int
     inventory_policy: Optional[str] = "deny"
+    # Same as the CSV's Custom Product Type (the search category filter). Left out on edit, the stored one is kept
+    product_type: Optional[str] = None
     image_url_1: Optional[str] = ""
     image_url_2: Optional[str] = ""
     image_url_3: Optional[str] = ""
@@ -208,22 +334,12 @@ def update_product(
         product.image_url_5 = payload.image_url_5
         
         db.commit()
+        bump_catalog_version(merchant_id)
+        lexical_indexes.upsert(merchant_id, [LexicalDoc(product.sku, payload.title, payload.handle)])
         
-        # Insert/Update to ChromaDB (naive approach: just add/update by ID)
+        # Update ChromaDB the way the catalog ingest does
         try:
-            from ingest_products import vectorstore
-            doc_text = f"Product: {payload.title} ({product.sku}). Category: {payload.handle}. Description: {payload.description}. Price: {payload.price}. In Stock: {payload.instock}. Inventory Policy: {payload.inventory_policy}."
-            vectorstore.add_texts(
-                texts=[doc_text],
-                metadatas=[{
-                    "merchant_id": merchant_id,
-                    "sku": product.sku,
-                    "handle": payload.handle,
-                    "price": payload.price,
-                    "inventory_policy": payload.inventory_policy
-                }],
-                ids=[f"{merchant_id}_{product.sku}"]
-            )
+            sync_product_vector(merchant_id, product, payload.product_type)
         except Exception as e:
             print(f"Warning: Failed to update product in ChromaDB: {e}")
             
@@ -239,23 +355,61 @@ def update_product(
 class OrderStatusUpdate(BaseModel):
     status: str
 
+ORDERS_PAGE_SIZE = 100
+ORDERS_MAX_PAGE_SIZE = 500
+
 @app.get("/orders")
-def get_orders(merchant_id: str = Depends(get_current_merchant), db: Session = Depends(get_db)):
+def get_orders(
+    response: Response,
+    limit: int = ORDERS_PAGE_SIZE,
+    cursor: Optional[str] = None,
+    merchant_id: str = Depends(get_current_merchant),
+    db: Session = Depends(get_db)
+):
     try:
-        orders = db.query(Order).filter(Order.merchant_id == merchant_id).order_by(Order.created_at.desc()).all()
+        limit = clamp_page_size(limit, ORDERS_MAX_PAGE_SIZE)
+
+        # Customer is joined in, items come from ONE extra IN query (instead of 1 + N + N + N*M round trips)
+        query = db.query(Order).options(
+            joinedload(Order.customer),
+            selectinload(Order.items)
+        ).filter(Order.merchant_id == merchant_id)
+
+        # Keyset pagination on id, newest first. Ids grow with created_at, and comparing an integer
+        # avoids datetime round-trips (SQLite stores created_at without the microseconds a bound
+        # datetime gets, so "created_at < cursor" matched every row and page 2 repeated page 1)
+        if cursor:
+            try:
+                # Older cursors carried (created_at, id), the id is always last
+                cursor_id = int(decode_cursor(cursor)[-1])
+            except (ValueError, IndexError, TypeError):
+                raise HTTPException(status_code=400, detail="Invalid pagination cursor")
+            query = query.filter(Order.id < cursor_id)
+
+        orders = query.order_by(Order.id.desc()).limit(limit + 1).all()
+        if len(orders) > limit:
+            orders = orders[:limit]
+            response.headers[NEXT_CURSOR_HEADER] = encode_cursor(orders[-1].id)
+
+        # One batched product lookup for every SKU on this page
+        skus = {item.product_sku for o in orders for item in o.items}
+        products = {}
+        if skus:
+            products = {
+                p.sku: p for p in db.query(Product.sku, Product.title, Product.image_url_1).filter(
+                    Product.merchant_id == merchant_id,
+                    Product.sku.in_(skus)
+                )
+            }
+
         result = []
         for o in orders:
-            customer = db.query(Customer).filter(Customer.id == o.customer_id).first()
-            items = db.query(OrderItem).filter(OrderItem.order_id == o.id).all()
+            customer = o.customer
             
             # Format items as detailed objects instead of a single string
             detailed_items = []
-            for item in items:
-                # Get Product to find the title
-                product = db.query(Product).filter(
-                    Product.sku == item.product_sku, 
-                    Product.merchant_id == merchant_id
-                ).first()
+            for item in o.items:
+                product = products.get(item.product_sku)
                 product_title = product.title if product else item.product_sku
                 img_url = product.image_url_1 if product else None
                 
@@ -283,22 +437,41 @@ def get_orders(merchant_id: str = Depends(get_current_merchant), db: Session = D
                 "created_at": o.created_at.isoformat() if o.created_at else None
             })
         return result
+    except HTTPException:
+        raise
     except Exception as e:
         import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/dashboard/stats")
-def get_dashboard_stats(merchant_id: str = Depends(get_current_merchant), db: Session = Depends(get_db)):
+def get_dashboard_stats(
+    top_window: str = "all",
+    merchant_id: str = Depends(get_current_merchant),
+    db: Session = Depends(get_db)
+):
+    if top_window not in TOP_PRODUCT_WINDOWS:
+        raise HTTPException(status_code=400, detail=f"top_window must be one of: {', '.join(TOP_PRODUCT_WINDOWS)}")
     try:
-        from models import Merchant, ProductQuery, ActivityLog
+        from models import Merchant, ActivityLog, DailyUsage, DailyOrderRollup
         from datetime import datetime, timedelta
+        from sqlalchemy import func
+
+        # Dashboard polling is served from a short-TTL per-merchant cache
+        cached = dashboard_cache.get((merchant_id, top_window))
+        if cached is not None:
+            return cached
         
-        total_orders = db.query(Order).filter(Order.merchant_id == merchant_id).count()
+        # Order counts come from the incrementally maintained daily rollups, not the orders table
+        total_orders = db.query(func.coalesce(func.sum(DailyOrderRollup.orders), 0)).filter(
+            DailyOrderRollup.merchant_id == merchant_id
+        ).scalar()
         total_products = db.query(Product).filter(Product.merchant_id == merchant_id).count()
         
         merchant = db.query(Merchant).filter(Merchant.merchant_id == merchant_id).first()
-        tokens = merchant.tokens_used if merchant else 0
+        # Include usage the ledger has buffered but not flushed yet
+        pending_usage = token_ledger.pending_for(merchant_id)
+        tokens = (merchant.tokens_used if merchant else 0) + sum(t for t, _ in pending_usage.values())
         
         # gpt-4o-mini blended estimate: ~$0.0000004 USD per token
         # Conversion to PKR: ~278 PKR per USD -> 0.0001112 PKR
@@ -306,30 +479,40 @@ def get_dashboard_stats(merchant_id: str = Depends(get_current_merchant), db: Se
         
         # --- Chart Data (Last 7 Days) ---
         today = datetime.now()
+        week_start = (today - timedelta(days=6)).date()
+        usage_rows = db.query(DailyUsage.day, DailyUsage.messages).filter(
+            DailyUsage.merchant_id == merchant_id,
+            DailyUsage.day >= week_start
+        ).all()
+        messages_by_day = {row.day: row.messages for row in usage_rows}
+        for day, (_, pending_messages) in pending_usage.items():
+            messages_by_day[day] = messages_by_day.get(day, 0) + pending_messages
+
+        # One grouped aggregate for the whole week instead of a count() per day
+        order_rows = db.query(
+            DailyOrderRollup.day,
+            func.sum(DailyOrderRollup.orders).label("orders"),
+            func.sum(DailyOrderRollup.cancelled).label("cancelled")
+        ).filter(
+            DailyOrderRollup.merchant_id == merchant_id,
+            DailyOrderRollup.day >= week_start
+        ).group_by(DailyOrderRollup.day).all()
+        orders_by_day = {row.day: row for row in order_rows}
+
         chart_data = []
         for i in range(6, -1, -1):
             target_date = today - timedelta(days=i)
-            day_start = target_date.replace(hour=0, minute=0, second=0, microsecond=0)
-            day_end = target_date.replace(hour=23, minute=59, second=59, microsecond=999999)
-            
-            day_orders = db.query(Order).filter(
-                Order.merchant_id == merchant_id,
-                Order.created_at >= day_start,
-                Order.created_at <= day_end
-            ).count()
+            day_rollup = orders_by_day.get(target_date.date())
             
             chart_data.append({
                 "day": target_date.strftime("%a"),
-                "orders": day_orders,
-                "messages": 0 # Placeholder for now unless we log per-day messages
+                "orders": int(day_rollup.orders) if day_rollup else 0,
+                "cancelled": int(day_rollup.cancelled) if day_rollup else 0,
+                "messages": messages_by_day.get(target_date.date(), 0)
             })
             
-        # --- Top Products ---
-        top_queries = db.query(ProductQuery).filter(
-            ProductQuery.merchant_id == merchant_id
-        ).order_by(ProductQuery.query_count.desc()).limit(5).all()
-        
-        top_products = [{"name": q.product_title, "queries": q.query_count} for q in top_queries]
+        # --- Top Products (last 24h / 7d from hourly buckets, or all time) ---
+        top_products = top_queried_products(db, merchant_id, top_window)
         
         # --- Recent Activity ---
         activities = db.query(ActivityLog).filter(
@@ -360,15 +543,18 @@ def get_dashboard_stats(merchant_id: str = Depends(get_current_merchant), db: Se
             "time": format_time_ago(a.created_at)
         } for a in activities]
         
-        return {
-            "total_orders": total_orders,
+        stats = {
+            "total_orders": int(total_orders),
             "total_products": total_products,
             "tokens_used": tokens,
             "est_cost": f"Rs. {est_cost_pkr:.1f}",
             "chart_data": chart_data,
             "top_products": top_products,
+            "top_window": top_window,
             "recent_activity": recent_activity
         }
+        dashboard_cache.set((merchant_id, top_window), stats)
+        return stats
     except Exception as e:
         import traceback
         traceback.print_exc()
@@ -381,8 +567,13 @@ def update_order_status(order_id: int, payload: OrderStatusUpdate, merchant_id:
         if not order:
             raise HTTPException(status_code=404, detail="Order not found")
             
+        previous_status = order.status
         order.status = payload.status
+        rollup = status_change_rollup(order, previous_status, order.status)
+        if rollup is not None:
+            db.execute(rollup)
         db.commit()
+        invalidate_dashboard(merchant_id)
         return {"status": "success", "new_status": order.status}
     except Exception as e:
         db.rollback()
@@ -390,46 +581,43 @@ def update_order_status(order_id: int, payload: OrderStatusUpdate, merchant_id:
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/upload-catalog")
+# Uploads are written to disk in chunks of this size instead of being read into memory at once
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+
+@app.post("/upload-catalog", status_code=202)
 async def upload_catalog(
     file: UploadFile = File(...), 
-    merchant_id: str = Depends(get_current_merchant),
-    db: Session = Depends(get_db)
+    merchant_id: str = Depends(get_current_merchant)
 ):
     if not file.filename.endswith(".csv"):
         raise HTTPException(status_code=400, detail="Only CSV files are allowed.")
     
-    # Save the file temporarily
+    # Save the file temporarily (the ingest job removes it when done)
     temp_filename = f"temp_{uuid.uuid4()}_{file.filename}"
     temp_filepath = os.path.join(os.getcwd(), temp_filename)
     
     try:
         with open(temp_filepath, "wb") as f:
-            content = await file.read()
-            f.write(content)
+            while chunk := await file.read(UPLOAD_CHUNK_BYTES):
+                f.write(chunk)
             
-        # Call ingestion script
-        total_processed = process_shopify_csv(temp_filepath, merchant_id)
-        
-        from models import ActivityLog
-        log = ActivityLog(
-            merchant_id=merchant_id,
-            action_text=f"New product catalog synced ({total_processed} items)",
-            action_type="info"
-        )
-        db.add(log)
-        db.commit()
-        
-        return {"status": "success", "processed_variants": total_processed}
+        # Parsing, MySQL writes and embeddings run on the ingest worker pool
+        job = submit_ingest_job(merchant_id, temp_filepath, file.filename)
+        return {"status": "queued", "job_id": job.job_id}
         
     except Exception as e:
+        if os.path.exists(temp_filepath):
+            os.remove(temp_filepath)
         import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        # Strict Cleanup
-        if os.path.exists(temp_filepath):
-            os.remove(temp_filepath)
+
+@app.get("/upload-catalog/{job_id}")
+async def get_upload_catalog_job(job_id: str, merchant_id: str = Depends(get_current_merchant)):
+    job = get_ingest_job(job_id, merchant_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Upload job not found")
+    return job.to_dict()
 
 @app.get("/download-sample-csv")
 def download_sample_csv():
@@ -461,16 +649,13 @@ def delete_all_products(merchant_id: str = Depends(get_current_merchant), db: Se
         )
         db.add(log)
         db.commit()
+        bump_catalog_version(merchant_id)
+        invalidate_dashboard(merchant_id)
+        lexical_indexes.invalidate(merchant_id)
         
         # Delete from ChromaDB
         try:
-            from ingest_products import vectorstore
-            # ChromaDB delete by metadata
-            # Note: ChromaDB doesn't natively support delete by where clause yet in all versions
-            # We must get the IDs first
-            result = vectorstore._collection.get(where={"merchant_id": merchant_id})
-            if result and result["ids"]:
-                vectorstore.delete(ids=result["ids"])
+            vector_store.delete_merchant(merchant_id)
         except Exception as e:
             print(f"Warning: Failed to delete from ChromaDB: {e}")
             
@@ -490,6 +675,8 @@ class SingleProductInput(BaseModel):
     sku_prefix: str
     instock: int
     inventory_policy: Optional[str] = "deny"
+    # Same as the CSV's Custom Product Type, searchable with the category filter
+    product_type: Optional[str] = None
     image_url_1: Optional[str] = ""
     image_url_2: Optional[str] = ""
     image_url_3: Optional[str] = ""
@@ -534,23 +721,13 @@ async def add_single_product(
         )
         db.add(log)
         db.commit()
+        bump_catalog_version(merchant_id)
+        invalidate_dashboard(merchant_id)
+        lexical_indexes.upsert(merchant_id, [LexicalDoc(full_sku, payload.title, payload.handle)])
         
         # Insert to ChromaDB
         try:
-            from ingest_products import vectorstore
-            doc_text = f"Product: {payload.title} ({full_sku}). Category: {payload.handle}. Description: {payload.description}. Price: {payload.price}. In Stock: {payload.instock}. Inventory Policy: {payload.inventory_policy}."
-            
-            vectorstore.add_texts(
-                texts=[doc_text],
-                metadatas=[{
-                    "merchant_id": merchant_id,
-                    "sku": full_sku,
-                    "handle": payload.handle,
-                    "price": payload.price,
-                    "inventory_policy": payload.inventory_policy
-                }],
-                ids=[f"{merchant_id}_{full_sku}"]
-            )
+            sync_product_vector(merchant_id, new_product, payload.product_type or "")
         except Exception as e:
             print(f"Warning: Failed to add single product to ChromaDB: {e}")
             
@@ -606,12 +783,13 @@ def delete_product(product_id: int, merchant_id: str = Depends(get_current_merch
         )
         db.add(log)
         db.commit()
+        bump_catalog_version(merchant_id)
+        invalidate_dashboard(merchant_id)
+        lexical_indexes.remove(merchant_id, [sku])
         
         # Delete from ChromaDB
         try:
-            from ingest_products import vectorstore
-            # ChromaDB items are IDs formatted as {merchant_id}_{sku}
-            vectorstore.delete(ids=[f"{merchant_id}_{sku}"])
+            vector_store.delete(merchant_id, [sku])
         except Exception as e:
             print(f"Warning: Failed to delete from ChromaDB: {e}")
             
@@ -0,0 +1,104 @@
+import os
+import time
+import threading
+from dataclasses import dataclass
+from typing import Optional
+
+from sqlalchemy import select
+
+from database import AsyncSessionLocal
+import models
+
+# ==========================================
+# Merchant Config Cache
+# ==========================================
+# Every inbound WhatsApp message used to hit the merchants table 2-3 times (phone id lookup,
+# prompt lookup, verify token lookup) before the LLM was even called. Settings change rarely,
+# so we keep a detached snapshot per merchant with a short TTL and secondary indexes for the
+# phone number id and the webhook verify token. PUT /settings invalidates explicitly.
+MERCHANT_CACHE_TTL_SECONDS = float(os.getenv("MERCHANT_CACHE_TTL_SECONDS", "60"))
+
+@dataclass(frozen=True)
+class MerchantConfig:
+    merchant_id: str
+    store_name: Optional[str] = None
+    system_prompt: Optional[str] = None
+    whatsapp_phone_number_id: Optional[str] = None
+    whatsapp_access_token: Optional[str] = None
+    webhook_verify_token: Optional[str] = None
+
+_lock = threading.Lock()
+_by_id = {}           # merchant_id -> (expires_at, MerchantConfig)
+_by_phone_id = {}     # whatsapp_phone_number_id -> merchant_id
+_by_verify_token = {} # webhook_verify_token -> merchant_id
+
+def _snapshot(merchant: models.Merchant) -> MerchantConfig:
+    return MerchantConfig(
+        merchant_id=merchant.merchant_id,
+        store_name=merchant.store_name,
+        system_prompt=merchant.system_prompt,
+        whatsapp_phone_number_id=merchant.whatsapp_phone_number_id,
+        whatsapp_access_token=merchant.whatsapp_access_token,
+        webhook_verify_token=merchant.webhook_verify_token,
+    )
+
+def _drop_locked(merchant_id: str):
+    entry = _by_id.pop(merchant_id, None)
+    if not entry:
+        return
+    config = entry[1]
+    if _by_phone_id.get(config.whatsapp_phone_number_id) == merchant_id:
+        _by_phone_id.pop(config.whatsapp_phone_number_id, None)
+    if _by_verify_token.get(config.webhook_verify_token) == merchant_id:
+        _by_verify_token.pop(config.webhook_verify_token, None)
+
+def _store(config: MerchantConfig) -> MerchantConfig:
+    with _lock:
+        _drop_locked(config.merchant_id)
+        _by_id[config.merchant_id] = (time.monotonic() + MERCHANT_CACHE_TTL_SECONDS, config)
+        if config.whatsapp_phone_number_id:
+            _by_phone_id[config.whatsapp_phone_number_id] = config.merchant_id
+        if config.webhook_verify_token:
+            _by_verify_token[config.webhook_verify_token] = config.merchant_id
+    return config
+
+def _cached(merchant_id: Optional[str]) -> Optional[MerchantConfig]:
+    if not merchant_id:
+        return None
+    with _lock:
+        entry = _by_id.get(merchant_id)
+        if not entry:
+            return None
+        if entry[0] < time.monotonic():
+            _drop_locked(merchant_id)
+            return None
+        return entry[1]
+
+async def _load(*criteria) -> Optional[MerchantConfig]:
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(select(models.Merchant).where(*criteria).limit(1))
+        merchant = result.scalars().first()
+        return _store(_snapshot(merchant)) if merchant else None
+
+async def get_merchant_config(merchant_id: str) -> Optional[MerchantConfig]:
+    config = _cached(merchant_id)
+    if config:
+        return config
+    return await _load(models.Merchant.merchant_id == merchant_id)
+
+async def get_merchant_by_phone_number_id(phone_number_id: str) -> Optional[MerchantConfig]:
+    config = _cached(_by_phone_id.get(phone_number_id))
+    if config and config.whatsapp_phone_number_id == phone_number_id:
+        return config
+    return await _load(models.Merchant.whatsapp_phone_number_id == phone_number_id)
+
+async def get_merchant_by_verify_token(token: str) -> Optional[MerchantConfig]:
+    config = _cached(_by_verify_token.get(token))
+    if config and config.webhook_verify_token == token:
+        return config
+    return await _load(models.Merchant.webhook_verify_token == token)
+
+def invalidate_merchant(merchant_id: str):
+    """Forget everything cached for this merchant (called whenever its settings are written)."""
+    with _lock:
+        _drop_locked(merchant_id)
@@ -0,0 +1,50 @@
+import sys
+from collections import defaultdict
+
+from vector_store import vector_store, LEGACY_COLLECTION
+
+# Moves vectors from the old shared "products" collection into one collection per merchant.
+# Embeddings are copied as they are, nothing is re-embedded. Safe to re-run (upserts by id).
+#   python migrate_vector_collections.py [--drop-legacy]
+PAGE_SIZE = 1000
+
+def migrate_vector_collections(drop_legacy: bool = False):
+    try:
+        legacy = vector_store.client.get_collection(LEGACY_COLLECTION)
+    except Exception:
+        print(f"No '{LEGACY_COLLECTION}' collection found, nothing to migrate.")
+        return
+
+    total = legacy.count()
+    print(f"Migrating {total} vectors from '{LEGACY_COLLECTION}'...")
+    moved = defaultdict(int)
+    skipped = 0
+    for offset in range(0, total, PAGE_SIZE):
+        page = legacy.get(limit=PAGE_SIZE, offset=offset, include=["documents", "metadatas", "embeddings"])
+        by_merchant = defaultdict(lambda: ([], [], [], []))
+        for doc_id, doc, meta, embedding in zip(page["ids"], page["documents"], page["metadatas"], page["embeddings"]):
+            merchant_id = (meta or {}).get("merchant_id")
+            if not merchant_id or not doc_id.startswith(f"{merchant_id}_"):
+                # Vectors without an owner were never searchable, leave them behind
+                skipped += 1
+                continue
+            skus, documents, metadatas, embeddings = by_merchant[merchant_id]
+            skus.append(doc_id[len(merchant_id) + 1:])
+            documents.append(doc)
+            metadatas.append(meta)
+            embeddings.append(embedding)
+
+        for merchant_id, (skus, documents, metadatas, embeddings) in by_merchant.items():
+            vector_store.upsert(merchant_id, skus, documents, metadatas, embeddings)
+            moved[merchant_id] += len(skus)
+        print(f"   {min(offset + PAGE_SIZE, total)}/{total}")
+
+    print(f"✅ Moved {sum(moved.values())} vectors into {len(moved)} merchant collections ({skipped} skipped)")
+    if drop_legacy:
+        vector_store.client.delete_collection(LEGACY_COLLECTION)
+        print(f"✅ Dropped '{LEGACY_COLLECTION}'")
+    else:
+        print(f"Re-run with --drop-legacy to delete '{LEGACY_COLLECTION}' once searches look right.")
+
+if __name__ == "__main__":
+    migrate_vector_collections(drop_legacy="--drop-legacy" in sys.argv[1:])
@@ -0,0 +1,59 @@
+import os
+import asyncio
+import random
+import uuid
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+import uvicorn
+
+# ==========================================
+# Mock Meta Graph API (offline load testing)
+# ==========================================
+# Mimics POST /{version}/{phone_number_id}/messages with configurable latency and a random
+# share of 429/500 responses so the retry/backoff path of whatsapp_sender.py gets exercised.
+#
+#   python mock_graph_api.py
+#   WHATSAPP_GRAPH_API_URL=http://localhost:8090/v21.0 python bench_whatsapp_sender.py
+MOCK_LATENCY_MS = float(os.getenv("MOCK_GRAPH_LATENCY_MS", "120"))
+MOCK_ERROR_RATE = float(os.getenv("MOCK_GRAPH_ERROR_RATE", "0.05"))
+MOCK_PORT = int(os.getenv("MOCK_GRAPH_PORT", "8090"))
+
+app = FastAPI(title="Mock WhatsApp Graph API")
+
+stats = {"received": 0, "delivered": 0, "throttled": 0, "failed": 0}
+
+@app.post("/{version}/{phone_number_id}/messages")
+async def send_message(version: str, phone_number_id: str, request: Request):
+    body = await request.json()
+    stats["received"] += 1
+
+    # Jittered latency roughly like the real API
+    await asyncio.sleep(MOCK_LATENCY_MS / 1000 * random.uniform(0.5, 1.5))
+
+    roll = random.random()
+    if roll < MOCK_ERROR_RATE / 2:
+        stats["throttled"] += 1
+        return JSONResponse(status_code=429, content={"error": {"message": "Rate limit hit", "code": 130429}})
+    if roll < MOCK_ERROR_RATE:
+        stats["failed"] += 1
+        return JSONResponse(status_code=500, content={"error": {"message": "Temporary failure", "code": 2}})
+
+    stats["delivered"] += 1
+    return {
+        "messaging_product": "whatsapp",
+        "contacts": [{"input": body.get("to"), "wa_id": body.get("to")}],
+        "messages": [{"id": f"wamid.{uuid.uuid4().hex}"}]
+    }
+
+@app.get("/stats")
+async def get_stats():
+    return stats
+
+@app.post("/stats/reset")
+async def reset_stats():
+    for key in stats:
+        stats[key] = 0
+    return stats
+
+if __name__ == "__main__":
+    uvicorn.run(app, host="0.0.0.0", port=MOCK_PORT, log_level="warning")
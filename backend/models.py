@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime, Date, UniqueConstraint
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from database import Base
@@ -17,6 +17,8 @@ class Merchant(Base):
     whatsapp_access_token = Column(String(1000), nullable=True)
     system_prompt = Column(String(5000), nullable=True)
     webhook_verify_token = Column(String(255), nullable=True, unique=True)
+    # Bumped by every catalog write, GET /products derives its ETag from it (catalog_version.py)
+    catalog_version = Column(Integer, nullable=False, default=0, server_default="0")
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
     customers = relationship("Customer", back_populates="merchant")
@@ -67,7 +69,9 @@ class OrderItem(Base):
 
 class Product(Base):
     __tablename__ = "products"
-    
+    # One row per merchant SKU, the catalog ingest upserts on this key
+    __table_args__ = (UniqueConstraint("merchant_id", "sku", name="uq_products_merchant_sku"),)
+
     id = Column(Integer, primary_key=True, index=True)
     merchant_id = Column(String(255), ForeignKey("merchants.merchant_id"), nullable=False, index=True)
     handle = Column(String(255), index=True, nullable=False)
@@ -88,6 +92,8 @@ class Product(Base):
 
 class ProductQuery(Base):
     __tablename__ = "product_queries"
+    # One counter row per merchant SKU, the query counter flush upserts on this key
+    __table_args__ = (UniqueConstraint("merchant_id", "product_sku", name="uq_product_queries_merchant_sku"),)
 
     id = Column(Integer, primary_key=True, index=True)
     merchant_id = Column(String(255), ForeignKey("merchants.merchant_id"), nullable=False, index=True)
@@ -96,6 +102,17 @@ class ProductQuery(Base):
     query_count = Column(Integer, default=1)
     last_queried = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
 
+class ProductQueryHourly(Base):
+    __tablename__ = "product_query_hourly"
+    __table_args__ = (UniqueConstraint("merchant_id", "product_sku", "hour", name="uq_product_query_hourly_merchant_sku_hour"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    merchant_id = Column(String(255), ForeignKey("merchants.merchant_id"), nullable=False, index=True)
+    product_sku = Column(String(100), nullable=False)
+    product_title = Column(String(255), nullable=False)
+    hour = Column(DateTime, nullable=False, index=True) # UTC, truncated to the hour
+    query_count = Column(Integer, default=0, nullable=False)
+
 class ActivityLog(Base):
     __tablename__ = "activity_logs"
 
@@ -104,3 +121,30 @@ class ActivityLog(Base):
     action_text = Column(String(500), nullable=False)
     action_type = Column(String(50), default="info") # success, info, warning
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class ProcessedMessage(Base):
+    __tablename__ = "processed_messages"
+
+    message_id = Column(String(255), primary_key=True) # WhatsApp message id (wamid...)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
+
+class DailyUsage(Base):
+    __tablename__ = "daily_usage"
+    __table_args__ = (UniqueConstraint("merchant_id", "day", name="uq_daily_usage_merchant_day"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    merchant_id = Column(String(255), ForeignKey("merchants.merchant_id"), nullable=False, index=True)
+    day = Column(Date, nullable=False)
+    tokens_used = Column(Integer, default=0, nullable=False)
+    messages = Column(Integer, default=0, nullable=False)
+
+class DailyOrderRollup(Base):
+    __tablename__ = "daily_order_rollups"
+    __table_args__ = (UniqueConstraint("merchant_id", "day", name="uq_daily_order_rollup_merchant_day"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    merchant_id = Column(String(255), ForeignKey("merchants.merchant_id"), nullable=False, index=True)
+    day = Column(Date, nullable=False)
+    orders = Column(Integer, default=0, nullable=False)
+    revenue = Column(Float, default=0.0, nullable=False)
+    cancelled = Column(Integer, default=0, nullable=False)
@@ -0,0 +1,148 @@
+import os
+import re
+
+from cache import LRUCache
+
+# ==========================================
+# Incremental Order-State Extraction
+# ==========================================
+# The dashboard panel (name / address / phone / quantity) used to cost a second structured LLM
+# call over the last 10 messages after EVERY agent reply, even for "hi". We now keep the
+# extracted state per thread, parse phone numbers and quantities deterministically, and only
+# ask the LLM when the new user messages plausibly carry a field that is still unresolved.
+PENDING = "Pending..."
+NO_QUANTITY = "—"
+DEFAULT_EXTRACTION = {"name": PENDING, "address": PENDING, "phone": PENDING, "quantity": NO_QUANTITY}
+
+EXTRACTION_STATE_SIZE = int(os.getenv("EXTRACTION_STATE_SIZE", "10000"))
+_thread_state = LRUCache(max_size=EXTRACTION_STATE_SIZE)  # thread_id -> {"fields": {...}, "seen": int}
+
+extraction_stats = {"llm_calls": 0, "skipped": 0, "deterministic_hits": 0}
+
+# Pakistani mobiles (03xx-xxxxxxx / +92 3xx xxxxxxx) first, then any reasonably long number
+PHONE_PATTERNS = [
+    re.compile(r"(?:\+92|0092|92|0)[\s-]?3\d{2}[\s-]?\d{7}\b"),
+    re.compile(r"\+?\d[\d\s-]{8,14}\d"),
+]
+NUMBER_WORDS = {
+    "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6, "seven": 7, "eight": 8, "nine": 9, "ten": 10,
+    "ek": 1, "aik": 1, "do": 2, "teen": 3, "char": 4, "chaar": 4, "panch": 5, "paanch": 5,
+}
+_NUMBER = r"(\d{1,3}|" + "|".join(NUMBER_WORDS) + r")"
+QUANTITY_PATTERNS = [
+    re.compile(r"\b(?:qty|quantity|x)\s*[:=]?\s*" + _NUMBER + r"\b", re.IGNORECASE),
+    re.compile(r"\b" + _NUMBER + r"\s*(?:x|pcs?|pieces?|items?|units?|qty|ada?d|pairs?)\b", re.IGNORECASE),
+]
+BARE_NUMBER = re.compile(r"^\s*" + _NUMBER + r"\s*$", re.IGNORECASE)
+
+# Words that suggest a message (or the question it answers) is about a given field
+FIELD_HINTS = {
+    "name": re.compile(r"\b(name|naam|i am|i'm|mera naam|this is)\b", re.IGNORECASE),
+    "address": re.compile(r"\b(address|pata|house|home|flat|street|st|road|rd|block|sector|phase|colony|town|city|mohalla|gali|near|province)\b|#\s*\d", re.IGNORECASE),
+    "phone": re.compile(r"\b(phone|number|mobile|contact|whatsapp)\b", re.IGNORECASE),
+    "quantity": re.compile(r"\b(quantity|qty|how many|kitne|kitni|pieces?)\b", re.IGNORECASE),
+}
+
+def _parse_number(token: str) -> int:
+    token = token.lower()
+    return NUMBER_WORDS[token] if token in NUMBER_WORDS else int(token)
+
+def parse_phone(text: str):
+    for pattern in PHONE_PATTERNS:
+        match = pattern.search(text)
+        if match:
+            return re.sub(r"[\s-]", "", match.group(0))
+    return None
+
+def parse_quantity(text: str, asked_for_quantity: bool = False):
+    for pattern in QUANTITY_PATTERNS:
+        match = pattern.search(text)
+        if match:
+            return str(_parse_number(match.group(1)))
+    # A bare "2" is only a quantity if that is what we just asked for
+    if asked_for_quantity:
+        match = BARE_NUMBER.match(text)
+        if match:
+            return str(_parse_number(match.group(1)))
+    return None
+
+def _unresolved(fields: dict) -> list:
+    return [key for key, default in DEFAULT_EXTRACTION.items() if fields.get(key, default) == default]
+
+def _last_ai_text(messages) -> str:
+    for msg in reversed(messages):
+        if msg.type == "ai" and isinstance(msg.content, str) and msg.content:
+            return msg.content
+    return ""
+
+async def update_order_extraction(thread_id: str, history: list, extraction_llm) -> dict:
+    """
+    Returns the current order details for a thread, only calling `extraction_llm`
+    when the user messages since the last call could fill an unresolved field.
+    Messages count as seen once handled; if the LLM call fails they are retried next turn.
+    """
+    state = _thread_state.get(thread_id)
+    if state is None or state["seen"] > len(history):
+        state = {"fields": dict(DEFAULT_EXTRACTION), "seen": 0}
+    fields = state["fields"]
+
+    new_messages = history[state["seen"]:]
+    previous_ai_text = _last_ai_text(history[:state["seen"]])
+    new_user_texts = [msg.content for msg in new_messages if msg.type == "human" and isinstance(msg.content, str)]
+    _thread_state.set(thread_id, state)
+
+    if not new_user_texts:
+        state["seen"] = len(history)
+        extraction_stats["skipped"] += 1
+        return dict(fields)
+
+    # 1. Deterministic parsers (latest mention wins, customers do correct themselves)
+    asked_for_quantity = bool(FIELD_HINTS["quantity"].search(previous_ai_text))
+    for text in new_user_texts:
+        phone = parse_phone(text)
+        if phone:
+            fields["phone"] = phone
+            extraction_stats["deterministic_hits"] += 1
+        quantity = parse_quantity(text, asked_for_quantity)
+        if quantity:
+            fields["quantity"] = quantity
+            extraction_stats["deterministic_hits"] += 1
+
+    # 2. Only pay for the LLM if the new messages plausibly answer something still unresolved
+    user_text = "\n".join(new_user_texts)
+    candidates = [
+        key for key in _unresolved(fields)
+        if FIELD_HINTS[key].search(user_text) or FIELD_HINTS[key].search(previous_ai_text)
+    ]
+    if not candidates:
+        state["seen"] = len(history)
+        extraction_stats["skipped"] += 1
+        return dict(fields)
+
+    extraction_stats["llm_calls"] += 1
+    try:
+        extraction_prompt = (
+            "Extract the customer order details from the new customer messages below. "
+            "Already known details are given for context; keep them unless the customer corrects them. "
+            f"If a detail is missing, strictly use the default values '{PENDING}' or '{NO_QUANTITY}' as defined in the schema.\n\n"
+            f"Known details: {fields}\n"
+            f"Assistant's previous message: {previous_ai_text}\n"
+            f"New customer messages: {new_user_texts}"
+        )
+        extracted = (await extraction_llm.ainvoke(extraction_prompt)).model_dump()
+        for key, default in DEFAULT_EXTRACTION.items():
+            value = extracted.get(key)
+            if value and value != default:
+                fields[key] = value
+        state["seen"] = len(history)
+    except Exception as e:
+        print(f"Extraction failed, will retry these messages next turn: {e}")
+
+    return dict(fields)
+
+def known_order_details(thread_id: str) -> dict:
+    """Order fields already resolved for a thread (used when older messages are trimmed)."""
+    state = _thread_state.get(thread_id) if thread_id else None
+    if state is None:
+        return {}
+    return {key: value for key, value in state["fields"].items() if value != DEFAULT_EXTRACTION[key]}
@@ -0,0 +1,28 @@
+import base64
+import json
+from fastapi import HTTPException
+
+# ==========================================
+# Keyset (cursor) pagination helpers
+# ==========================================
+# Cursors are opaque to clients: the sort key of the last row on a page, JSON encoded and
+# base64url'd. The next page is returned in the X-Next-Cursor response header so list endpoints
+# keep returning a plain JSON array.
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+def encode_cursor(*values) -> str:
+    raw = json.dumps(list(values), separators=(",", ":"), default=str)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> list:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if not isinstance(values, list):
+            raise ValueError("cursor must encode a list")
+        return values
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid pagination cursor")
+
+def clamp_page_size(limit: int, max_size: int) -> int:
+    return max(1, min(limit, max_size))
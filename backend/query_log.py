@@ -0,0 +1,126 @@
+import os
+import time
+import asyncio
+import traceback
+from datetime import datetime, timezone, timedelta
+
+from sqlalchemy import func, delete
+
+from database import AsyncSessionLocal, upsert
+from dashboard_stats import invalidate_dashboard, TOP_PRODUCT_WINDOWS
+import models
+
+# ==========================================
+# Buffered Product Query Counters
+# ==========================================
+# search_products used to read the ProductQuery row and write `query_count += 1` before it
+# could answer the customer: an extra round trip on the response path and a lost update under
+# concurrent chats. Hits are now counted in memory and flushed every few seconds as
+#   INSERT INTO product_queries ... ON DUPLICATE KEY UPDATE query_count = query_count + :n
+# into the all-time counters and, the same way, into hourly buckets (product_query_hourly) so
+# the dashboard can rank products by recent demand (see top_queried_products).
+QUERY_LOG_FLUSH_INTERVAL_SECONDS = float(os.getenv("QUERY_LOG_FLUSH_INTERVAL_SECONDS", "10"))
+# Hourly buckets older than this are deleted (the longest dashboard window is 7 days)
+QUERY_HOURLY_RETENTION_DAYS = int(os.getenv("QUERY_HOURLY_RETENTION_DAYS", "30"))
+PRUNE_INTERVAL_SECONDS = 3600
+
+class ProductQueryCounter:
+    def __init__(self, flush_interval: float = QUERY_LOG_FLUSH_INTERVAL_SECONDS):
+        self.flush_interval = flush_interval
+        self._pending = {}  # (merchant_id, sku, hour) -> [count, title]
+        self._task = None
+        self._last_prune = None
+
+    def record(self, merchant_id: str, sku: str, title: str):
+        hour = datetime.now(timezone.utc).replace(tzinfo=None, minute=0, second=0, microsecond=0)
+        entry = self._pending.setdefault((merchant_id, sku, hour), [0, title])
+        entry[0] += 1
+        entry[1] = title
+
+    async def flush(self):
+        if not self._pending:
+            return
+        # Swap the buffer first so searches finishing during the flush land in the next batch
+        pending, self._pending = self._pending, {}
+
+        now = datetime.now(timezone.utc)
+        all_time = {}
+        for (merchant_id, sku, _), (count, title) in pending.items():
+            row = all_time.setdefault((merchant_id, sku), {
+                "merchant_id": merchant_id, "product_sku": sku, "product_title": title, "query_count": 0, "last_queried": now
+            })
+            row["query_count"] += count
+        hourly = [
+            {"merchant_id": merchant_id, "product_sku": sku, "product_title": title, "hour": hour, "query_count": count}
+            for (merchant_id, sku, hour), (count, title) in pending.items()
+        ]
+        async with AsyncSessionLocal() as db:
+            try:
+                await db.execute(upsert(
+                    models.ProductQuery, list(all_time.values()), ["merchant_id", "product_sku"],
+                    increment=("query_count",), replace=("product_title", "last_queried")
+                ))
+                await db.execute(upsert(
+                    models.ProductQueryHourly, hourly, ["merchant_id", "product_sku", "hour"],
+                    increment=("query_count",), replace=("product_title",)
+                ))
+                await db.commit()
+            except Exception as e:
+                await db.rollback()
+                print(f"Failed to flush product query counts, will retry: {e}")
+                # Put the counts back so they are retried on the next flush
+                for key, (count, title) in pending.items():
+                    entry = self._pending.setdefault(key, [0, title])
+                    entry[0] += count
+                return
+
+        for merchant_id in {merchant_id for merchant_id, _, _ in pending}:
+            invalidate_dashboard(merchant_id)
+
+    async def prune(self):
+        cutoff = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(days=QUERY_HOURLY_RETENTION_DAYS)
+        async with AsyncSessionLocal() as db:
+            await db.execute(delete(models.ProductQueryHourly).where(models.ProductQueryHourly.hour < cutoff))
+            await db.commit()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+                if self._last_prune is None or time.monotonic() - self._last_prune > PRUNE_INTERVAL_SECONDS:
+                    self._last_prune = time.monotonic()
+                    await self.prune()
+            except Exception:
+                traceback.print_exc()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+
+product_query_counter = ProductQueryCounter()
+
+def top_queried_products(db, merchant_id: str, window: str, limit: int = 5) -> list:
+    """Most searched products in `window`, read from the pre-aggregated counters."""
+    span = TOP_PRODUCT_WINDOWS[window]
+    if span is None:
+        rows = db.query(models.ProductQuery.product_title, models.ProductQuery.query_count).filter(
+            models.ProductQuery.merchant_id == merchant_id
+        ).order_by(models.ProductQuery.query_count.desc()).limit(limit).all()
+        return [{"name": title, "queries": count} for title, count in rows]
+
+    since = datetime.now(timezone.utc).replace(tzinfo=None, minute=0, second=0, microsecond=0) - span
+    total = func.sum(models.ProductQueryHourly.query_count)
+    rows = db.query(
+        func.max(models.ProductQueryHourly.product_title), total
+    ).filter(
+        models.ProductQueryHourly.merchant_id == merchant_id,
+        models.ProductQueryHourly.hour > since
+    ).group_by(models.ProductQueryHourly.product_sku).order_by(total.desc()).limit(limit).all()
+    return [{"name": title, "queries": int(count)} for title, count in rows]
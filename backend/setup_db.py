@@ -1,5 +1,29 @@
-from database import Base, engine, MYSQL_URI
+from sqlalchemy import inspect, text
+from database import Base, engine, MYSQL_URI, SessionLocal
 from models import *
+from dashboard_stats import backfill_order_rollups
+
+def ensure_unique_key(table: str, name: str, columns: list, before_dedupe: str = None):
+    # create_all does not add constraints to existing tables, the bulk upserts need these keys
+    constraints = inspect(engine).get_unique_constraints(table)
+    if any(c["name"] == name for c in constraints):
+        return
+    join_on = " AND ".join(f"t1.{col} = t2.{col}" for col in columns)
+    with engine.begin() as conn:
+        if before_dedupe:
+            conn.execute(text(before_dedupe))
+        # Older code paths could leave duplicate rows behind, keep the newest row of each
+        conn.execute(text(f"DELETE t1 FROM {table} t1 JOIN {table} t2 ON {join_on} AND t1.id < t2.id"))
+        conn.execute(text(f"ALTER TABLE {table} ADD CONSTRAINT {name} UNIQUE ({', '.join(columns)})"))
+    print(f"✅ Added unique key on {table} ({', '.join(columns)})")
+
+def ensure_column(table: str, name: str, ddl: str):
+    # create_all does not add columns to existing tables either
+    if any(c["name"] == name for c in inspect(engine).get_columns(table)):
+        return
+    with engine.begin() as conn:
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {name} {ddl}"))
+    print(f"✅ Added column {table}.{name}")
 
 def setup_cloud_db():
     print(f"Connecting to MySQL/TiDB at: {MYSQL_URI.split('@')[1] if '@' in MYSQL_URI else '...'}...")
@@ -7,6 +31,27 @@ def setup_cloud_db():
         # Create all tables defined in models.py
         Base.metadata.create_all(bind=engine)
         print("\n✅ Successfully connected and created all necessary tables in MySQL!")
+
+        ensure_column("merchants", "catalog_version", "INT NOT NULL DEFAULT 0")
+        ensure_unique_key("products", "uq_products_merchant_sku", ["merchant_id", "sku"])
+        ensure_unique_key(
+            "product_queries", "uq_product_queries_merchant_sku", ["merchant_id", "product_sku"],
+            # Fold the counts of duplicate rows into the row that is kept
+            before_dedupe=(
+                "UPDATE product_queries p JOIN ("
+                "SELECT MAX(id) AS keep_id, SUM(query_count) AS total FROM product_queries "
+                "GROUP BY merchant_id, product_sku HAVING COUNT(*) > 1"
+                ") d ON p.id = d.keep_id SET p.query_count = d.total"
+            )
+        )
+
+        # Seed the dashboard rollups from any orders that existed before the table did
+        db = SessionLocal()
+        try:
+            days = backfill_order_rollups(db)
+            print(f"✅ Rebuilt dashboard order rollups ({days} merchant-days)")
+        finally:
+            db.close()
     except Exception as e:
         print(f"\n❌ Error setting up MySQL Database: {e}")
         
@@ -0,0 +1,96 @@
+import os
+import sys
+import uuid
+import asyncio
+import tempfile
+
+# Throwaway SQLite database, Chroma directory and embedding cache, set before the app modules read them
+_TMP = tempfile.mkdtemp(prefix="search-filters-")
+os.environ["MYSQL_URI"] = f"sqlite:///{os.path.join(_TMP, 'test.db')}"
+os.environ["CHROMA_DB_PATH"] = os.path.join(_TMP, "chroma_db")
+os.environ["EMBEDDING_CACHE_DB_PATH"] = os.path.join(_TMP, "embedding_cache.sqlite")
+os.environ.setdefault("OPENAI_API_KEY", "sk-test")
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import pytest
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from database import Base, engine, SessionLocal
+from vector_store import vector_store
+from lexical_index import lexical_indexes
+import models
+import tools
+
+# Run with: cd backend && python -m pytest test_search_filters.py
+
+# Catalog as the ingest stored it before search_products had filters: no instock or category
+# in the metadata, the product type only in the document text
+LEGACY_CATALOG = [
+    # sku, title, product type, price, instock, inventory policy
+    ("RS-01", "Red Running Shoe", "Running Shoes", 10.0, 0, "deny"),
+    ("BS-01", "Blue Running Shoe", "Running Shoes", 12.0, 4, "deny"),
+    ("GS-01", "Green Running Shoe", "Running Shoes", 30.0, 0, "continue"),
+    ("HAT-9", "Sun Hat", "Hats", 5.0, 3, "deny"),
+]
+
+@pytest.fixture
+def legacy_merchant():
+    merchant_id = f"merchant-{uuid.uuid4().hex[:8]}"
+    embeddings = DeterministicFakeEmbedding(size=8)
+    vector_store.embeddings = embeddings
+    tools.query_embeddings.embeddings = embeddings
+
+    Base.metadata.create_all(engine)
+    db = SessionLocal()
+    try:
+        db.add(models.Merchant(merchant_id=merchant_id))
+        for sku, title, product_type, price, instock, policy in LEGACY_CATALOG:
+            db.add(models.Product(
+                merchant_id=merchant_id, handle=title.lower().replace(" ", "-"), sku=sku, title=title,
+                description="", price=price, instock=instock, inventory_policy=policy
+            ))
+        db.commit()
+    finally:
+        db.close()
+
+    documents = [
+        f"Product: {title} ({sku}). Category: {product_type}. Tags: . Description: . Options: . "
+        f"Price: {price}. In Stock: {instock}. Inventory Policy: {policy}."
+        for sku, title, product_type, price, instock, policy in LEGACY_CATALOG
+    ]
+    vector_store.upsert(
+        merchant_id,
+        [sku for sku, *_ in LEGACY_CATALOG],
+        documents,
+        [{"sku": sku, "handle": title.lower().replace(" ", "-"), "price": price, "inventory_policy": policy}
+         for sku, title, _, price, _, policy in LEGACY_CATALOG],
+        embeddings.embed_documents(documents)
+    )
+    yield merchant_id
+    lexical_indexes.invalidate(merchant_id)
+    vector_store.delete_merchant(merchant_id)
+
+def _search(merchant_id: str, **arguments) -> str:
+    config = {"configurable": {"merchant_id": merchant_id}}
+    return asyncio.run(tools.search_products.ainvoke(arguments, config=config))
+
+def test_in_stock_only_finds_products_stored_without_instock(legacy_merchant):
+    result = _search(legacy_merchant, query="running shoe", in_stock_only=True)
+
+    assert "BS-01" in result
+    assert "GS-01" in result  # out of stock but "continue" keeps it orderable
+    assert "RS-01" not in result
+
+def test_backfill_fills_filter_metadata_from_products_table(legacy_merchant):
+    _search(legacy_merchant, query="running shoe", in_stock_only=True)
+
+    metadata = vector_store.get(legacy_merchant, ["BS-01", "HAT-9"])
+    assert metadata["BS-01"]["metadata"]["instock"] == 4
+    assert metadata["BS-01"]["metadata"]["category"] == "running-shoes"
+    assert metadata["HAT-9"]["metadata"]["category"] == "hats"
+
+def test_category_filter_finds_products_stored_without_category(legacy_merchant):
+    result = _search(legacy_merchant, query="something to wear", category="Hats", in_stock_only=True, max_price=8)
+
+    assert "HAT-9" in result
+    assert "BS-01" not in result
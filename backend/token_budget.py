@@ -0,0 +1,109 @@
+import os
+import json
+
+from langchain_core.messages import SystemMessage, ToolMessage, trim_messages
+from langchain_core.messages.utils import count_tokens_approximately
+from langchain_core.runnables.config import RunnableConfig
+from langchain_core.utils.function_calling import convert_to_openai_tool
+
+from order_extraction import known_order_details
+
+# ==========================================
+# Per-Turn Token Budget
+# ==========================================
+# Every model call used to send the full thread (the checkpointer keeps it unbounded) with every
+# search result ever returned in it, so cost and latency grew with the length of the chat.
+# The agent's pre_model_hook now fits what the model sees into AGENT_TOKEN_BUDGET:
+#   1. tool results from earlier turns are cut to a short excerpt (they were already answered from);
+#      search results keep every product's title, SKU, price and stock, place_cod_order needs the SKU
+#   2. the oldest turns are dropped, whole turns only, so tool calls never lose their results
+#   3. if anything was dropped, the order details collected so far are restated in one line
+# The checkpointed history itself is untouched. Counts are estimates (about 4 chars per token),
+# the exact usage still comes from OpenAI and is reported next to them per turn.
+AGENT_TOKEN_BUDGET = int(os.getenv("AGENT_TOKEN_BUDGET", "6000"))
+OLD_TOOL_RESULT_CHARS = int(os.getenv("OLD_TOOL_RESULT_CHARS", "400"))
+
+def estimate_fixed_tokens(system_prompt: str, tools: list) -> int:
+    """Tokens sent on every call regardless of the history: the system prompt and tool schemas."""
+    schemas = json.dumps([convert_to_openai_tool(tool) for tool in tools])
+    return count_tokens_approximately([SystemMessage(content=system_prompt)]) + len(schemas) // 4
+
+def _compact_search_result(content: str) -> str:
+    # One line per product from tools._compact_result: "- Title (SKU: X) | Rs. 12 | In stock: 4 | Options: ... | description"
+    lines = []
+    for line in content.splitlines():
+        if line.startswith("Image URL:"):
+            continue
+        if line.startswith("- "):
+            parts = line.split(" | ")
+            if len(parts) >= 3:
+                line = " | ".join(parts[:3] + [part for part in parts[3:] if part.startswith("Options: ")])
+            elif len(line) > OLD_TOOL_RESULT_CHARS:
+                # Raw document fallback, it starts with "Product: Title (SKU)."
+                line = line[:OLD_TOOL_RESULT_CHARS] + " …[truncated]"
+        lines.append(line)
+    return "\n".join(lines)
+
+def _compact_tool_result(message: ToolMessage) -> ToolMessage:
+    if not isinstance(message.content, str) or len(message.content) <= OLD_TOOL_RESULT_CHARS:
+        return message
+    if message.name == "search_products":
+        content = _compact_search_result(message.content)
+        return message if content == message.content else message.model_copy(update={"content": content})
+    return message.model_copy(update={"content": message.content[:OLD_TOOL_RESULT_CHARS] + " …[truncated]"})
+
+def make_budget_hook(fixed_tokens: int, budget: int = AGENT_TOKEN_BUDGET):
+    """
+    Builds the pre_model_hook for one agent. `fixed_tokens` is estimate_fixed_tokens() of its prompt.
+    Appends a breakdown of every model call to config["configurable"]["token_report"] when given.
+    """
+    def budget_hook(state: dict, config: RunnableConfig) -> dict:
+        messages = state["messages"]
+        current_turn = max((i for i, msg in enumerate(messages) if msg.type == "human"), default=0)
+
+        compacted = 0
+        history = []
+        for i, msg in enumerate(messages):
+            if i < current_turn and isinstance(msg, ToolMessage):
+                short = _compact_tool_result(msg)
+                compacted += short is not msg
+                msg = short
+            history.append(msg)
+
+        kept = trim_messages(
+            history,
+            max_tokens=max(budget - fixed_tokens, 0),
+            token_counter=count_tokens_approximately,
+            strategy="last",
+            start_on="human",
+            allow_partial=False
+        )
+        # The current turn is always sent, even if it alone is over budget
+        if len(kept) < len(history) - current_turn:
+            kept = history[current_turn:]
+        dropped = len(history) - len(kept)
+
+        configurable = config.get("configurable", {})
+        if dropped:
+            details = known_order_details(configurable.get("thread_id"))
+            if details:
+                summary = ", ".join(f"{key}: {value}" for key, value in details.items())
+                kept = [SystemMessage(content=f"Earlier messages were trimmed. Order details collected so far: {summary}."), *kept]
+
+        report = configurable.get("token_report")
+        if report is not None:
+            history_tokens = count_tokens_approximately(kept)
+            report.append({
+                "budget": budget,
+                "fixed_tokens": fixed_tokens,
+                "history_tokens": history_tokens,
+                "tool_result_tokens": count_tokens_approximately([msg for msg in kept if isinstance(msg, ToolMessage)]),
+                "estimated_input_tokens": fixed_tokens + history_tokens,
+                "messages_sent": len(kept),
+                "messages_dropped": dropped,
+                "tool_results_compacted": compacted,
+            })
+
+        return {"llm_input_messages": kept}
+
+    return budget_hook
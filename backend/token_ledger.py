@@ -0,0 +1,94 @@
+import os
+import asyncio
+import traceback
+from collections import defaultdict
+from datetime import date
+
+from sqlalchemy import update
+
+from database import AsyncSessionLocal, upsert
+import models
+
+# ==========================================
+# Buffered Token Accounting
+# ==========================================
+# Every chat turn used to load the merchant row and do `tokens_used += n`, a hot-row
+# read-modify-write that loses updates under concurrency. Usage now accumulates in memory per
+# (merchant, day) and a background task flushes it every few seconds as atomic increments:
+#   UPDATE merchants SET tokens_used = tokens_used + :n
+#   INSERT INTO daily_usage ... ON DUPLICATE KEY UPDATE tokens_used = tokens_used + :n, messages = messages + :m
+TOKEN_FLUSH_INTERVAL_SECONDS = float(os.getenv("TOKEN_FLUSH_INTERVAL_SECONDS", "10"))
+
+class TokenLedger:
+    def __init__(self, flush_interval: float = TOKEN_FLUSH_INTERVAL_SECONDS):
+        self.flush_interval = flush_interval
+        self._pending = defaultdict(lambda: [0, 0])  # (merchant_id, day) -> [tokens, messages]
+        self._task = None
+
+    def record(self, merchant_id: str, tokens: int, messages: int = 1):
+        usage = self._pending[(merchant_id, date.today())]
+        usage[0] += tokens
+        usage[1] += messages
+
+    def pending_for(self, merchant_id: str) -> dict:
+        """Usage recorded but not flushed yet: {day: (tokens, messages)}."""
+        return {day: tuple(usage) for (mid, day), usage in list(self._pending.items()) if mid == merchant_id}
+
+    async def flush(self):
+        if not self._pending:
+            return
+        # Swap the buffer first so turns finishing during the flush land in the next batch
+        pending, self._pending = self._pending, defaultdict(lambda: [0, 0])
+
+        merchant_tokens = defaultdict(int)
+        for (merchant_id, _), (tokens, _) in pending.items():
+            merchant_tokens[merchant_id] += tokens
+
+        async with AsyncSessionLocal() as db:
+            try:
+                for merchant_id, tokens in merchant_tokens.items():
+                    result = await db.execute(
+                        update(models.Merchant)
+                        .where(models.Merchant.merchant_id == merchant_id)
+                        .values(tokens_used=models.Merchant.tokens_used + tokens)
+                    )
+                    # daily_usage references merchants, so make sure the row exists
+                    if result.rowcount == 0 and await db.get(models.Merchant, merchant_id) is None:
+                        db.add(models.Merchant(merchant_id=merchant_id, tokens_used=tokens))
+                        await db.flush()
+
+                rows = [
+                    {"merchant_id": merchant_id, "day": day, "tokens_used": tokens, "messages": messages}
+                    for (merchant_id, day), (tokens, messages) in pending.items()
+                ]
+                await db.execute(upsert(
+                    models.DailyUsage, rows, ["merchant_id", "day"], increment=("tokens_used", "messages")
+                ))
+                await db.commit()
+            except Exception as e:
+                await db.rollback()
+                print(f"Failed to flush token usage, will retry: {e}")
+                # Put the usage back so it is retried on the next flush
+                for key, (tokens, messages) in pending.items():
+                    self._pending[key][0] += tokens
+                    self._pending[key][1] += messages
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                traceback.print_exc()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+
+token_ledger = TokenLedger()
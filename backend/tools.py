@@ -1,104 +1,225 @@
 
+import os
+import re
+import asyncio
+import operator
+from typing import Optional
 from pydantic import BaseModel, Field
 from langchain.tools import tool
 from langchain_core.runnables.config import RunnableConfig
-import chromadb
-from langchain_openai import OpenAIEmbeddings
-from database import SessionLocal
+from database import AsyncSessionLocal
 import models
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from vector_store import vector_store, normalize_category
+from embedding_cache import QueryEmbeddingCache
+from lexical_index import lexical_indexes, reciprocal_rank_fusion
+from query_log import product_query_counter
+from dashboard_stats import rollup_increment, status_change_rollup, invalidate_dashboard, order_day
 
 # ==========================================
 # GLOBAL INITIALIZATION (Speed Optimization)
 # ==========================================
 # Initialize these ONCE when the server boots, not on every tool call.
-chroma_client = chromadb.PersistentClient(path="./chroma_db")
-collection = chroma_client.get_or_create_collection(name="products")
-embeddings = OpenAIEmbeddings(model="text-embedding-3-small")
+# Chroma and the embedding model are shared with ingestion through vector_store.py
+# Repeated queries are answered from memory / local disk instead of another OpenAI call
+query_embeddings = QueryEmbeddingCache(vector_store.embeddings)
 
 # ==========================================
 # 1. Search Tool
 # ==========================================
+# Candidates taken from each ranking before fusion
+SEARCH_CANDIDATES_FACTOR = 3
+# Description characters kept per result; the agent only needs enough to describe the product
+SEARCH_DESCRIPTION_CHARS = int(os.getenv("SEARCH_DESCRIPTION_CHARS", "160"))
+_HTML_TAG = re.compile(r"<[^>]+>")
+
+def _similarity(distance: float) -> float:
+    # Default Chroma L2 distance for normalized vectors is between 0 and 2.
+    # Cosine similarity = 1 - (distance^2 / 2). If distance is already L2 squared (which Chroma uses by default for embeddings):
+    # Similarity % = (1 - (distance / 2)) * 100
+    return max(0, min(100, (1 - (distance / 2)) * 100))
+
+_FILTER_OPERATORS = {"$gt": operator.gt, "$gte": operator.ge, "$lte": operator.le}
+
+def _product_filter(in_stock_only: bool, min_price: float, max_price: float, category: str):
+    """Chroma `where` clause for the structured search arguments, None when none are set."""
+    conditions = []
+    if in_stock_only:
+        # "continue" variants keep selling at zero stock, they are still available to order
+        conditions.append({"$or": [{"instock": {"$gt": 0}}, {"inventory_policy": "continue"}]})
+    if min_price is not None:
+        conditions.append({"price": {"$gte": float(min_price)}})
+    if max_price is not None:
+        conditions.append({"price": {"$lte": float(max_price)}})
+    category_key = normalize_category(category)
+    if category_key:
+        conditions.append({"$or": [{"category": category_key}, {"handle": category_key}]})
+    if not conditions:
+        return None
+    return conditions[0] if len(conditions) == 1 else {"$and": conditions}
+
+def _matches_filter(metadata: dict, where: dict) -> bool:
+    """Evaluates a `_product_filter` clause the way Chroma would, for the lexical hits."""
+    if "$and" in where:
+        return all(_matches_filter(metadata, clause) for clause in where["$and"])
+    if "$or" in where:
+        return any(_matches_filter(metadata, clause) for clause in where["$or"])
+    (field, condition), = where.items()
+    value = metadata.get(field)
+    if isinstance(condition, dict):
+        (op, operand), = condition.items()
+        return value is not None and _FILTER_OPERATORS[op](value, operand)
+    return value == condition
+
+async def _filter_skus(merchant_id: str, skus: list, where: dict) -> set:
+    # The lexical index has no stock or price, check the candidates against their Chroma metadata
+    stored = await asyncio.to_thread(vector_store.get, merchant_id, skus)
+    return {sku for sku, record in stored.items() if _matches_filter(record["metadata"] or {}, where)}
+
+def _compact_result(product, options: str) -> str:
+    """
+    One line per product with only what the agent shows or orders with. The stored document
+    (tags, inventory policy, the full HTML description) cost far more prompt tokens.
+    """
+    if (product.instock or 0) > 0:
+        availability = f"In stock: {product.instock}"
+    elif product.inventory_policy == "continue":
+        availability = "Available to order"
+    else:
+        availability = "Out of stock"
+    price = f"{product.price:.0f}" if float(product.price).is_integer() else f"{product.price:.2f}"
+    parts = [f"{product.title} (SKU: {product.sku})", f"Rs. {price}", availability]
+    if options:
+        parts.append(f"Options: {options}")
+    description = " ".join(_HTML_TAG.sub(" ", product.description or "").split())
+    if description:
+        if len(description) > SEARCH_DESCRIPTION_CHARS:
+            description = description[:SEARCH_DESCRIPTION_CHARS].rsplit(" ", 1)[0] + "…"
+        parts.append(description)
+    return " | ".join(parts)
+
+async def _lexical_documents(merchant_id: str, index, skus: list) -> dict:
+    # Lexical hits come from the index, their text still lives in Chroma
+    stored = await asyncio.to_thread(vector_store.get, merchant_id, skus, ("documents",))
+    result = {}
+    for sku in skus:
+        doc = stored[sku]["document"] if sku in stored else None
+        if doc is None:
+            entry = index.get(sku)
+            doc = f"Product: {entry.title if entry else sku} ({sku})."
+        result[sku] = doc
+    return result
+
+async def _retrieve(query: str, merchant_id: str, limit: int, where: dict = None) -> list:
+    """
+    Returns up to `limit` (sku, document, score) matches. Exact and high-confidence lexical
+    hits skip the embedding call, everything else fuses BM25 and vector rankings.
+    `where` (see _product_filter) restricts both rankings.
+    """
+    index = await lexical_indexes.get(merchant_id)
+    exact = index.exact_matches(query)
+    lexical_hits = index.search(query, limit * SEARCH_CANDIDATES_FACTOR)
+    if where and (exact or lexical_hits):
+        candidates = list(dict.fromkeys(exact + [sku for sku, _ in lexical_hits]))
+        allowed = await _filter_skus(merchant_id, candidates, where)
+        exact = [sku for sku in exact if sku in allowed]
+        lexical_hits = [(sku, score) for sku, score in lexical_hits if sku in allowed]
+    if exact or index.is_confident(query, lexical_hits):
+        skus = exact[:limit] if exact else [lexical_hits[0][0]]
+        documents = await _lexical_documents(merchant_id, index, skus)
+        return [(sku, documents[sku], 100.0) for sku in skus]
+
+    query_embedding = await query_embeddings.aembed_query(query)
+    # Chroma's client is synchronous, run the ANN query off the event loop
+    results = await asyncio.to_thread(
+        vector_store.query, merchant_id, query_embedding, limit * SEARCH_CANDIDATES_FACTOR, where
+    )
+
+    vector_hits = {}
+    for sku, doc, meta, distance in results:
+        if sku and sku not in vector_hits:
+            vector_hits[sku] = (doc, _similarity(distance))
+
+    fused = reciprocal_rank_fusion(list(vector_hits), [sku for sku, _ in lexical_hits])[:limit]
+    lexical_only = [sku for sku, _ in fused if sku not in vector_hits]
+    documents = await _lexical_documents(merchant_id, index, lexical_only) if lexical_only else {}
+    lexical_scores = dict(lexical_hits)
+    top_lexical = lexical_hits[0][1] if lexical_hits else 1
+
+    matches = []
+    for sku, _ in fused:
+        if sku in vector_hits:
+            matches.append((sku, *vector_hits[sku]))
+        else:
+            matches.append((sku, documents[sku], 100 * lexical_scores[sku] / top_lexical))
+    return matches
+
 @tool
-def search_products(query: str, config: RunnableConfig, limit: int = 5) -> str:
-    """Use this tool to search the store's catalog for products based on the customer's query. Returns product names, variants, prices, and descriptions."""
+async def search_products(
+    query: str,
+    config: RunnableConfig,
+    limit: int = 5,
+    in_stock_only: bool = False,
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None,
+    category: Optional[str] = None
+) -> str:
+    """Use this tool to search the store's catalog for products based on the customer's query. Returns product names, variants, prices, and descriptions.
+    Set in_stock_only to skip products that cannot be ordered, min_price/max_price for a budget (Rs.), and category for a product type or handle (e.g. "shoes")."""
     merchant_id = config["configurable"].get("merchant_id")
     if not merchant_id:
         return "Internal Error: Merchant context missing."
 
     try:
-        query_embedding = embeddings.embed_query(query)
-        results = collection.query(
-            query_embeddings=[query_embedding],
-            n_results=limit,
-            where={"merchant_id": merchant_id},
-            include=['metadatas', 'documents', 'distances']
-        )
+        where = _product_filter(in_stock_only, min_price, max_price, category)
+        matches = await _retrieve(query, merchant_id, limit, where)
         
-        if not results['documents'] or not results['documents'][0]:
+        if not matches:
             return "No products found matching that description."
             
         formatted_results = "Here are the products I found:\n"
         
         # We need to query the database to get the live image URLs for these matched vectors
-        db: Session = SessionLocal()
+        # (one IN query for every match instead of a lookup per SKU)
+        products = {}
         try:
-            search_results_list = config["configurable"].get("search_results")
-            
-            for i, doc in enumerate(results['documents'][0]):
-                meta = results['metadatas'][0][i]
-                sku = meta.get("sku", "")
-                
-                # Default Chroma L2 distance for normalized vectors is between 0 and 2.
-                # Cosine similarity = 1 - (distance^2 / 2). If distance is already L2 squared (which Chroma uses by default for embeddings):
-                # Similarity % = (1 - (distance / 2)) * 100
-                distance = results['distances'][0][i] if 'distances' in results and results['distances'] else 0
-                similarity_score = max(0, min(100, (1 - (distance / 2)) * 100))
-                
-                image_url_text = ""
-                if sku:
-                    product = db.query(models.Product).filter(
-                        models.Product.sku == sku,
-                        models.Product.merchant_id == merchant_id
-                    ).first()
-                    
-                    if product:
-                        # Log ONLY the top 1 product query to keep the dashboard accurate to what the user actually asked for
-                        if i == 0:
-                            query_log = db.query(models.ProductQuery).filter(
-                                models.ProductQuery.product_sku == sku,
-                                models.ProductQuery.merchant_id == merchant_id
-                            ).first()
-                            
-                            if query_log:
-                                query_log.query_count += 1
-                            else:
-                                new_query = models.ProductQuery(
-                                    merchant_id=merchant_id,
-                                    product_sku=sku,
-                                    product_title=product.title
-                                )
-                                db.add(new_query)
-                        
-                        if search_results_list is not None:
-                             # Prevent duplicates in the visual list
-                             if not any(item.get("name") == product.title for item in search_results_list):
-                                 search_results_list.append({
-                                     "name": product.title,
-                                     "score": similarity_score
-                                 })
-                             
-                        if product.image_url_1:
-                            image_url_text = f"\nImage URL: {product.image_url_1}"
+            skus = [sku for sku, _, _ in matches if sku]
+            async with AsyncSessionLocal() as db:
+                rows = (await db.execute(select(models.Product).where(
+                    models.Product.merchant_id == merchant_id,
+                    models.Product.sku.in_(skus)
+                ))).scalars().all()
+            products = {product.sku: product for product in rows}
+        except Exception as query_e:
+            print(f"Non-fatal error loading matched products: {query_e}")
+
+        search_results_list = config["configurable"].get("search_results")
+        # Variant options live in the lexical index (already loaded by _retrieve)
+        index = await lexical_indexes.get(merchant_id)
+        
+        for i, (sku, doc, similarity_score) in enumerate(matches):
+            image_url_text = ""
+            product = products.get(sku)
+            if product:
+                entry = index.get(sku)
+                doc = _compact_result(product, entry.options if entry else "")
+                # Log ONLY the top 1 product query to keep the dashboard accurate to what the user actually asked for
+                # (buffered and flushed in the background, see query_log.py)
+                if i == 0:
+                    product_query_counter.record(merchant_id, sku, product.title)
                 
-                formatted_results += f"- {doc}{image_url_text}\n"
+                if search_results_list is not None:
+                     # Prevent duplicates in the visual list
+                     if not any(item.get("name") == product.title for item in search_results_list):
+                         search_results_list.append({
+                             "name": product.title,
+                             "score": similarity_score
+                         })
+                     
+                if product.image_url_1:
+                    image_url_text = f"\nImage URL: {product.image_url_1}"
             
-            db.commit() # Save the query logs
-        except Exception as query_e:
-            db.rollback()
-            print(f"Non-fatal error logging query: {query_e}")
-        finally:
-            db.close()
+            formatted_results += f"- {doc}{image_url_text}\n"
             
         return formatted_results
     except Exception as e:
@@ -117,7 +238,7 @@ class PlaceOrderInput(BaseModel):
     total_amount: float = Field(..., description="Calculated total price provided by the AI")
 
 @tool(args_schema=PlaceOrderInput)
-def place_cod_order(
+async def place_cod_order(
     customer_name: str, 
     phone_number: str, 
     delivery_address: str, 
@@ -131,14 +252,14 @@ def place_cod_order(
     if not merchant_id:
         return "Internal Error: Merchant context missing."
 
-    db: Session = SessionLocal()
+    db = AsyncSessionLocal()
     
     try:
         # A. Create or get Customer for this specific merchant
-        customer = db.query(models.Customer).filter(
+        customer = (await db.execute(select(models.Customer).where(
             models.Customer.phone == phone_number, 
             models.Customer.merchant_id == merchant_id
-        ).first()
+        ).limit(1))).scalars().first()
         
         if not customer:
             customer = models.Customer(
@@ -148,21 +269,21 @@ def place_cod_order(
                 phone=phone_number
             )
             db.add(customer)
-            db.flush() # Get the new ID
+            await db.flush() # Get the new ID
         else:
             # Update address and name in case they changed it
             customer.address = delivery_address
             customer.name = customer_name
-            db.flush()
+            await db.flush()
             
         # B. Verify product
-        product = db.query(models.Product).filter(
+        product = (await db.execute(select(models.Product).where(
             models.Product.sku == product_sku, 
             models.Product.merchant_id == merchant_id
-        ).first()
+        ).limit(1))).scalars().first()
         
         if not product:
-            db.rollback()
+            await db.rollback()
             return f"Error: Product with SKU {product_sku} not found in our database."
             
         price = product.price
@@ -177,7 +298,9 @@ def place_cod_order(
             total_amount=actual_total
         )
         db.add(new_order)
-        db.flush()
+        await db.flush()
+        # created_at is set by the DB, load it so the rollup uses the same day as backfill_order_rollups
+        await db.refresh(new_order, attribute_names=["created_at"])
         
         # D. Add Item
         order_item.order_id = new_order.id
@@ -192,15 +315,19 @@ def place_cod_order(
             action_type="success"
         )
         db.add(log)
+
+        # F. Dashboard rollup, same transaction as the order itself
+        await db.execute(rollup_increment(merchant_id, order_day(new_order), orders=1, revenue=actual_total))
         
-        db.commit()
+        await db.commit()
+        invalidate_dashboard(merchant_id)
         return f"Order placed successfully! Order ID is #{formatted_id}. Total amount to be paid on delivery: Rs. {actual_total:.2f}."
         
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         return f"An error occurred while placing the order: {str(e)}"
     finally:
-        db.close()
+        await db.close()
 
 # Add this schema near your other Pydantic models
 class UpdateAddressInput(BaseModel):
@@ -211,35 +338,35 @@ class UpdateAddressInput(BaseModel):
 # 3. Update Address Tool
 # ==========================================
 @tool(args_schema=UpdateAddressInput)
-def update_delivery_address(order_id: int, new_address: str, config: RunnableConfig) -> str:
+async def update_delivery_address(order_id: int, new_address: str, config: RunnableConfig) -> str:
     """Use this tool when a customer asks to change their delivery address for an existing order."""
     merchant_id = config["configurable"].get("merchant_id")
-    db: Session = SessionLocal()
+    db = AsyncSessionLocal()
     
     try:
         # Verify the order exists and belongs to this merchant
-        order = db.query(models.Order).filter(
+        order = (await db.execute(select(models.Order).where(
             models.Order.id == order_id,
             models.Order.merchant_id == merchant_id
-        ).first()
+        ).limit(1))).scalars().first()
         
         if not order:
             return f"Error: Order #{order_id} not found."
             
         # Update the customer's address
-        customer = db.query(models.Customer).filter(models.Customer.id == order.customer_id).first()
+        customer = await db.get(models.Customer, order.customer_id) if order.customer_id else None
         if customer:
             customer.address = new_address
-            db.commit()
+            await db.commit()
             return f"Successfully updated the delivery address for Order #{order_id} to: {new_address}."
         else:
             return "Error: Customer record not found for this order."
             
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         return f"Database error while updating address: {str(e)}"
     finally:
-        db.close()
+        await db.close()
 
 # Add this schema
 class CancelOrderInput(BaseModel):
@@ -249,16 +376,16 @@ class CancelOrderInput(BaseModel):
 # 4. Cancel Order Tool
 # ==========================================
 @tool(args_schema=CancelOrderInput)
-def cancel_order(order_id: int, config: RunnableConfig) -> str:
+async def cancel_order(order_id: int, config: RunnableConfig) -> str:
     """Use this tool when a customer explicitly requests to cancel their order."""
     merchant_id = config["configurable"].get("merchant_id")
-    db: Session = SessionLocal()
+    db = AsyncSessionLocal()
     
     try:
-        order = db.query(models.Order).filter(
+        order = (await db.execute(select(models.Order).where(
             models.Order.id == order_id,
             models.Order.merchant_id == merchant_id
-        ).first()
+        ).limit(1))).scalars().first()
         
         if not order:
             return f"Error: Order #{order_id} not found."
@@ -266,7 +393,11 @@ def cancel_order(order_id: int, config: RunnableConfig) -> str:
         if order.status == "Cancelled":
             return f"Order #{order_id} is already cancelled."
             
+        previous_status = order.status
         order.status = "Cancelled"
+        rollup = status_change_rollup(order, previous_status, order.status)
+        if rollup is not None:
+            await db.execute(rollup)
         
         formatted_id = f"ORD-{order.id:04d}"
         log = models.ActivityLog(
@@ -276,11 +407,12 @@ def cancel_order(order_id: int, config: RunnableConfig) -> str:
         )
         db.add(log)
         
-        db.commit()
+        await db.commit()
+        invalidate_dashboard(merchant_id)
         return f"Successfully cancelled Order #{order_id}."
         
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         return f"Database error while cancelling order: {str(e)}"
     finally:
-        db.close()
+        await db.close()
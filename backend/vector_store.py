@@ -0,0 +1,167 @@
+import os
+import re
+import hashlib
+import threading
+
+import chromadb
+from langchain_openai import OpenAIEmbeddings
+
+# ==========================================
+# Vector Store Service
+# ==========================================
+# One Chroma client and one embedding model for the whole process. Ingestion, the search tool
+# and the product endpoints all go through `vector_store` instead of opening ./chroma_db
+# separately (which loaded the HNSW index twice and had two clients writing the same SQLite file).
+# Every merchant has its own collection, so a search only touches that tenant's index and
+# wiping a catalog is a collection drop. Callers pass SKUs; collections, document ids
+# ("{merchant_id}_{sku}") and the merchant_id metadata are handled here.
+# Writes are serialized with a lock; reads go straight to Chroma, which guards its own index.
+# Data from the old shared "products" collection is moved over by migrate_vector_collections.py.
+CHROMA_DB_PATH = os.getenv("CHROMA_DB_PATH", "./chroma_db")
+LEGACY_COLLECTION = "products"
+COLLECTION_PREFIX = "products-"
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-3-small")
+# Max documents per Chroma write / embedding request (Chroma rejects very large batches)
+VECTOR_BATCH_SIZE = int(os.getenv("VECTOR_BATCH_SIZE", "1000"))
+
+def _batches(items: list, size: int = VECTOR_BATCH_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+def normalize_category(text: str) -> str:
+    # "Running Shoes" / "running_shoes" -> "running-shoes", the same shape as a Shopify handle,
+    # so the search filter can compare one value against both the category and the handle
+    return re.sub(r"[^a-z0-9]+", "-", (text or "").lower()).strip("-")
+
+def collection_name(merchant_id: str) -> str:
+    # Clerk ids are not guaranteed to fit Chroma's naming rules, hash them into a fixed-size name
+    return COLLECTION_PREFIX + hashlib.sha1(merchant_id.encode("utf-8")).hexdigest()[:24]
+
+class VectorStore:
+    def __init__(self, path: str = CHROMA_DB_PATH, embedding_model: str = EMBEDDING_MODEL):
+        self.client = chromadb.PersistentClient(path=path)
+        self.embeddings = OpenAIEmbeddings(model=embedding_model)
+        self._collections = {}
+        self._write_lock = threading.RLock()
+        self._collections_lock = threading.Lock()
+
+    def _collection(self, merchant_id: str):
+        collection = self._collections.get(merchant_id)
+        if collection is None:
+            with self._collections_lock:
+                collection = self._collections.get(merchant_id)
+                if collection is None:
+                    # We always pass our own embeddings, never let Chroma embed with its default model
+                    collection = self.client.get_or_create_collection(
+                        name=collection_name(merchant_id),
+                        embedding_function=None,
+                        metadata={"merchant_id": merchant_id}
+                    )
+                    self._collections[merchant_id] = collection
+        return collection
+
+    def legacy_count(self) -> int:
+        """Vectors still in the old shared collection (0 once migrated)."""
+        try:
+            return self.client.get_collection(LEGACY_COLLECTION).count()
+        except Exception:
+            return 0
+
+    @staticmethod
+    def doc_id(merchant_id: str, sku: str) -> str:
+        return f"{merchant_id}_{sku}"
+
+    @staticmethod
+    def _sku(merchant_id: str, doc_id: str) -> str:
+        return doc_id[len(merchant_id) + 1:]
+
+    def add_texts(self, merchant_id: str, skus: list, texts: list, metadatas: list):
+        """Embeds `texts` and upserts them, in batches."""
+        for batch in _batches(list(zip(skus, texts, metadatas))):
+            batch_texts = [text for _, text, _ in batch]
+            # Embed outside the lock, it is a network call
+            vectors = self.embeddings.embed_documents(batch_texts)
+            self.upsert(merchant_id, [sku for sku, _, _ in batch], batch_texts, [meta for _, _, meta in batch], vectors)
+
+    def upsert(self, merchant_id: str, skus: list, documents: list, metadatas: list, embeddings: list):
+        """Writes documents with precomputed embeddings (e.g. re-used ones)."""
+        rows = list(zip(skus, documents, metadatas, embeddings))
+        collection = self._collection(merchant_id)
+        with self._write_lock:
+            for batch in _batches(rows):
+                collection.upsert(
+                    ids=[self.doc_id(merchant_id, sku) for sku, _, _, _ in batch],
+                    documents=[doc for _, doc, _, _ in batch],
+                    # Strict clerk isolation: every vector carries its merchant
+                    metadatas=[{**meta, "merchant_id": merchant_id} for _, _, meta, _ in batch],
+                    embeddings=[vector for _, _, _, vector in batch]
+                )
+
+    def update_metadata(self, merchant_id: str, skus: list, metadatas: list):
+        """Replaces the metadata of existing records, leaving documents and embeddings as they are."""
+        rows = list(zip(skus, metadatas))
+        collection = self._collection(merchant_id)
+        with self._write_lock:
+            for batch in _batches(rows):
+                collection.update(
+                    ids=[self.doc_id(merchant_id, sku) for sku, _ in batch],
+                    metadatas=[{**meta, "merchant_id": merchant_id} for _, meta in batch]
+                )
+
+    def get(self, merchant_id: str, skus: list = None, include: tuple = ("metadatas",)) -> dict:
+        """
+        Stored records by SKU: {sku: {"document": ..., "metadata": ..., "embedding": ...}}
+        (only the included fields). Without `skus`, returns every record of the merchant.
+        """
+        key_names = {"documents": "document", "metadatas": "metadata", "embeddings": "embedding"}
+        collection = self._collection(merchant_id)
+        if skus is None:
+            results = [collection.get(include=list(include))]
+        else:
+            results = [
+                collection.get(ids=[self.doc_id(merchant_id, sku) for sku in batch], include=list(include))
+                for batch in _batches(list(skus))
+            ]
+        records = {}
+        for result in results:
+            for i, doc_id in enumerate(result["ids"]):
+                records[self._sku(merchant_id, doc_id)] = {
+                    key_names[field]: result[field][i] for field in include
+                }
+        return records
+
+    def query(self, merchant_id: str, embedding: list, n_results: int, where: dict = None) -> list:
+        """Nearest neighbours as (sku, document, metadata, distance), closest first."""
+        result = self._collection(merchant_id).query(
+            query_embeddings=[embedding],
+            n_results=n_results,
+            where=where or None,
+            include=["metadatas", "documents", "distances"]
+        )
+        return [
+            (self._sku(merchant_id, doc_id), doc, meta, distance)
+            for doc_id, doc, meta, distance in zip(
+                result["ids"][0], result["documents"][0], result["metadatas"][0], result["distances"][0]
+            )
+        ]
+
+    def delete(self, merchant_id: str, skus: list):
+        collection = self._collection(merchant_id)
+        with self._write_lock:
+            for batch in _batches(list(skus)):
+                collection.delete(ids=[self.doc_id(merchant_id, sku) for sku in batch])
+
+    def delete_merchant(self, merchant_id: str) -> int:
+        """Drops the merchant's collection, returns how many vectors it held."""
+        with self._write_lock:
+            count = self._collection(merchant_id).count()
+            with self._collections_lock:
+                self._collections.pop(merchant_id, None)
+            self.client.delete_collection(collection_name(merchant_id))
+        return count
+
+vector_store = VectorStore()
+_legacy_vectors = vector_store.legacy_count()
+if _legacy_vectors:
+    print(f"Warning: {_legacy_vectors} vectors are still in the shared '{LEGACY_COLLECTION}' collection, "
+          "run migrate_vector_collections.py to move them into per-merchant collections.")
@@ -1,60 +1,25 @@
-from fastapi import APIRouter, Request, HTTPException, BackgroundTasks
+from fastapi import APIRouter, Request, HTTPException
 from fastapi.responses import PlainTextResponse
-import requests
 import traceback
 
 
-from database import SessionLocal
-import models
 from brain import process_chat_message
+from merchant_cache import get_merchant_config, get_merchant_by_phone_number_id, get_merchant_by_verify_token
+from whatsapp_sender import send_whatsapp_message
+from conversation_queue import ConversationQueue
+from idempotency import claim_message
 
 router = APIRouter()
 
 # The verify token is now mapped dynamically per-merchant via the DB.
 
-def send_whatsapp_message(phone_number_id: str, access_token: str, recipient_phone: str, text: str):
-    """
-    Sends an outbound text message via Meta's Graph API.
-    """
-    url = f"https://graph.facebook.com/v21.0/{phone_number_id}/messages"
-    
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json"
-    }
-    
-    payload = {
-        "messaging_product": "whatsapp",
-        "to": recipient_phone,
-        "type": "text",
-        "text": {
-            "body": text
-        }
-    }
-    
-    print(f"Sending message to {recipient_phone} from {phone_number_id}")
-    try:
-        response = requests.post(url, headers=headers, json=payload, timeout=10)
-        response.raise_for_status()
-        print("Successfully sent WhatsApp message")
-        return True
-    except requests.exceptions.HTTPError as e:
-        print(f"Failed to send message. HTTP Error: {e.response.text}")
-        return False
-    except Exception as e:
-        print(f"Error sending WhatsApp message: {e}")
-        return False
-
 async def process_whatsapp_message_async(sender_phone: str, message_text: str, phone_number_id: str):
     """
     Background Task to communicate with the DB, process AI response, and send the message back.
     """
-    db = SessionLocal()
     try:
-        # Find which merchant owns this WhatsApp Business Phone Number ID
-        merchant = db.query(models.Merchant).filter(
-            models.Merchant.whatsapp_phone_number_id == phone_number_id
-        ).first()
+        # Find which merchant owns this WhatsApp Business Phone Number ID (served from the config cache)
+        merchant = await get_merchant_by_phone_number_id(phone_number_id)
 
         if not merchant:
             print(f"Error: No merchant found linked to phone_number_id {phone_number_id}")
@@ -73,8 +38,8 @@ async def process_whatsapp_message_async(sender_phone: str, message_text: str, p
         
         ai_reply = result.get("response", "Sorry, I am currently down for maintenance.")
         
-        # Dispatch the text back to WhatsApp
-        send_whatsapp_message(
+        # Dispatch the text back to WhatsApp (pooled async client, retried on 429/5xx)
+        await send_whatsapp_message(
             phone_number_id=phone_number_id,
             access_token=merchant.whatsapp_access_token,
             recipient_phone=sender_phone,
@@ -84,8 +49,28 @@ async def process_whatsapp_message_async(sender_phone: str, message_text: str, p
     except Exception:
         print("Fatal error processing WhatsApp webhook in background:")
         traceback.print_exc()
-    finally:
-        db.close()
+
+async def process_conversation_turn(key, messages: list):
+    """
+    Runs ONE agent turn for everything a customer sent during the debounce window.
+    Called serially per (merchant_id, sender_phone) by the conversation queue.
+    """
+    merchant_id, sender_phone = key
+    merchant = await get_merchant_config(merchant_id)
+    if not merchant or not merchant.whatsapp_phone_number_id:
+        print(f"Error: Merchant {merchant_id} no longer has a WhatsApp number configured.")
+        return
+
+    if len(messages) > 1:
+        print(f"Coalesced {len(messages)} messages from {sender_phone} into one turn")
+
+    await process_whatsapp_message_async(
+        sender_phone=sender_phone,
+        message_text="\n".join(messages),
+        phone_number_id=merchant.whatsapp_phone_number_id
+    )
+
+conversation_queue = ConversationQueue(handler=process_conversation_turn)
 
 
 @router.get("/")
@@ -100,65 +85,64 @@ async def verify_webhook(request: Request):
     challenge = request.query_params.get("hub.challenge")
 
     if mode == "subscribe" and token:
-        db = SessionLocal()
-        try:
-            # Check if ANY merchant has this verify token active
-            merchant = db.query(models.Merchant).filter(
-                models.Merchant.webhook_verify_token == token
-            ).first()
-            
-            if merchant:
-                print(f"Webhook verified successfully for Merchant: {merchant.store_name} ({merchant.merchant_id})!")
-                return PlainTextResponse(content=challenge, status_code=200)
-            else:
-                print(f"Failed webhook verification: Unknown token '{token}'")
-                raise HTTPException(status_code=403, detail="Verification failed: Unknown token")
-        finally:
-            db.close()
+        # Check if ANY merchant has this verify token active
+        merchant = await get_merchant_by_verify_token(token)
+        
+        if merchant:
+            print(f"Webhook verified successfully for Merchant: {merchant.store_name} ({merchant.merchant_id})!")
+            return PlainTextResponse(content=challenge, status_code=200)
+        else:
+            print(f"Failed webhook verification: Unknown token '{token}'")
+            raise HTTPException(status_code=403, detail="Verification failed: Unknown token")
     
     raise HTTPException(status_code=403, detail="Verification failed")
 
 @router.post("/")
-async def receive_whatsapp_message(request: Request, background_tasks: BackgroundTasks):
+async def receive_whatsapp_message(request: Request):
     """
     Step 2: Receiving Messages.
     WhatsApp sends the actual user messages here.
     """
     body = await request.json()
 
-    try:
-        # WhatsApp sends lots of updates (like "read" receipts). 
-        # We only want to process actual text messages.
-        entry = body.get("entry", [])[0]
-        changes = entry.get("changes", [])[0]
-        value = changes.get("value", {})
-        
-        if "messages" in value:
-            phone_number_id = value.get("metadata", {}).get("phone_number_id")
-            message = value["messages"][0]
-            
-            # We ONLY process text messages for now (ignoring images/audio/locations out of scope)
-            if "text" in message:
-                sender_phone = message["from"]
-                message_text = message["text"]["body"]
-                
-                print(f"New text message from {sender_phone} to endpoint {phone_number_id}: {message_text}")
-                
-                # Hand it off to a BackgroundTask so we can instantly return 200 OK to Meta.
-                # If we delay processing (LLMs are slow), Meta will retry and cause infinite loops.
-                background_tasks.add_task(
-                    process_whatsapp_message_async, 
-                    sender_phone=sender_phone, 
-                    message_text=message_text, 
-                    phone_number_id=phone_number_id
-                )
-
-    except IndexError:
-        pass
-    except KeyError:
-        pass
-    except Exception as e:
-        print(f"Error parsing webhook payload: {e}")
+    # Meta batches events: one delivery can carry several entries/changes/messages.
+    # WhatsApp also sends lots of updates (like "read" receipts) that have no messages at all.
+    for entry in body.get("entry", []):
+        for change in entry.get("changes", []):
+            try:
+                value = change.get("value", {})
+                messages = value.get("messages", [])
+                if not messages:
+                    continue
+
+                phone_number_id = value.get("metadata", {}).get("phone_number_id")
+                merchant = await get_merchant_by_phone_number_id(phone_number_id)
+                if not merchant:
+                    print(f"Error: No merchant found linked to phone_number_id {phone_number_id}")
+                    continue
+
+                for message in messages:
+                    # We ONLY process text messages for now (ignoring images/audio/locations out of scope)
+                    if "text" not in message:
+                        continue
+
+                    # Meta re-delivers on slow acks, never run a second agent turn for the same message
+                    if not await claim_message(message.get("id")):
+                        print(f"Skipping duplicate delivery of WhatsApp message {message.get('id')}")
+                        continue
+
+                    sender_phone = message["from"]
+                    message_text = message["text"]["body"]
+                    
+                    print(f"New text message from {sender_phone} to endpoint {phone_number_id}: {message_text}")
+                    
+                    # Hand it off to the per-conversation queue so we can instantly return 200 OK to Meta.
+                    # If we delay processing (LLMs are slow), Meta will retry and cause infinite loops.
+                    # Bursts from the same customer are merged into one ordered agent turn.
+                    conversation_queue.enqueue((merchant.merchant_id, sender_phone), message_text)
+
+            except Exception as e:
+                print(f"Error parsing webhook payload: {e}")
 
     # You MUST return a 200 OK fast, or Meta will think your server is down and retry.
     return {"status": "success"}
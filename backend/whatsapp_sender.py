@@ -0,0 +1,108 @@
+import os
+import asyncio
+import random
+from typing import Optional
+
+import httpx
+
+# ==========================================
+# Outbound WhatsApp Delivery
+# ==========================================
+# One keep-alive HTTP client is shared by every reply so we stop paying a fresh TLS handshake
+# to graph.facebook.com per message. Sends are bounded per phone_number_id (Meta rate limits
+# per business number) and 429/5xx responses are retried with exponential backoff, as are
+# errors raised before the request went out. A read timeout or a dropped connection is not
+# retried: Meta may already have accepted the message, and a retry would send it twice.
+# Point WHATSAPP_GRAPH_API_URL at mock_graph_api.py to load test offline.
+GRAPH_API_URL = os.getenv("WHATSAPP_GRAPH_API_URL", "https://graph.facebook.com/v21.0").rstrip("/")
+MAX_CONCURRENCY_PER_NUMBER = int(os.getenv("WHATSAPP_MAX_CONCURRENCY_PER_NUMBER", "8"))
+MAX_RETRIES = int(os.getenv("WHATSAPP_SEND_MAX_RETRIES", "4"))
+BACKOFF_BASE_SECONDS = float(os.getenv("WHATSAPP_SEND_BACKOFF_SECONDS", "0.5"))
+BACKOFF_MAX_SECONDS = 30.0
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+# Raised before the request reached the Graph API (PoolTimeout: no connection was free)
+RETRYABLE_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+_client: Optional[httpx.AsyncClient] = None
+_number_limits = {}  # phone_number_id -> asyncio.Semaphore
+
+def get_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            timeout=httpx.Timeout(10.0, connect=5.0),
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+        )
+    return _client
+
+async def close_client():
+    """Closes the shared client (called on app shutdown)."""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+def _number_limit(phone_number_id: str) -> asyncio.Semaphore:
+    semaphore = _number_limits.get(phone_number_id)
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(MAX_CONCURRENCY_PER_NUMBER)
+        _number_limits[phone_number_id] = semaphore
+    return semaphore
+
+def _retry_delay(attempt: int, response: Optional[httpx.Response]) -> float:
+    # Honour Meta's Retry-After when it sends one, otherwise exponential backoff with jitter
+    if response is not None:
+        retry_after = response.headers.get("Retry-After")
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), BACKOFF_MAX_SECONDS)
+    delay = BACKOFF_BASE_SECONDS * (2 ** attempt)
+    return min(delay + random.uniform(0, delay), BACKOFF_MAX_SECONDS)
+
+async def send_whatsapp_message(phone_number_id: str, access_token: str, recipient_phone: str, text: str) -> bool:
+    """
+    Sends an outbound text message via Meta's Graph API.
+    """
+    url = f"{GRAPH_API_URL}/{phone_number_id}/messages"
+
+    headers = {
+        "Authorization": f"Bearer {access_token}",
+        "Content-Type": "application/json"
+    }
+
+    payload = {
+        "messaging_product": "whatsapp",
+        "to": recipient_phone,
+        "type": "text",
+        "text": {
+            "body": text
+        }
+    }
+
+    print(f"Sending message to {recipient_phone} from {phone_number_id}")
+    client = get_client()
+    async with _number_limit(phone_number_id):
+        for attempt in range(MAX_RETRIES + 1):
+            response = None
+            try:
+                response = await client.post(url, headers=headers, json=payload)
+                if response.status_code < 400:
+                    print("Successfully sent WhatsApp message")
+                    return True
+                if response.status_code not in RETRYABLE_STATUS_CODES:
+                    print(f"Failed to send message. HTTP Error {response.status_code}: {response.text}")
+                    return False
+                print(f"WhatsApp send throttled/failed with {response.status_code} (attempt {attempt + 1})")
+            except RETRYABLE_ERRORS as e:
+                print(f"WhatsApp send connection error (attempt {attempt + 1}): {e}")
+            except httpx.TransportError as e:
+                print(f"WhatsApp send failed after the request went out, not retrying: {e!r}")
+                return False
+            except Exception as e:
+                print(f"Error sending WhatsApp message: {e}")
+                return False
+
+            if attempt < MAX_RETRIES:
+                await asyncio.sleep(_retry_delay(attempt, response))
+
+    print(f"Giving up on WhatsApp message to {recipient_phone} after {MAX_RETRIES + 1} attempts")
+    return False
@@ -18,3 +18,31 @@ export async function authFetch(
   }
   return fetch(url, { ...options, headers });
 }
+
+/**
+ * Fetches every page of a cursor-paginated list endpoint (GET /orders, GET /products).
+ * The backend returns one page as a JSON array and the next page's cursor in the
+ * X-Next-Cursor header; this follows it until the last page. A repeated cursor or an
+ * empty page also ends the loop, so a misbehaving endpoint cannot keep it fetching forever.
+ */
+export async function fetchAllPages<T>(
+  url: string,
+  getToken: () => Promise<string | null>
+): Promise<T[]> {
+  const items: T[] = [];
+  const seen = new Set<string>();
+  let cursor: string | null = null;
+  do {
+    const pageUrl = new URL(url);
+    if (cursor) {
+      seen.add(cursor);
+      pageUrl.searchParams.set("cursor", cursor);
+    }
+    const res = await authFetch(pageUrl.toString(), getToken);
+    if (!res.ok) throw new Error(`Failed to fetch ${pageUrl.pathname}`);
+    const page = (await res.json()) as T[];
+    items.push(...page);
+    cursor = page.length ? res.headers.get("X-Next-Cursor") : null;
+  } while (cursor && !seen.has(cursor));
+  return items;
+}
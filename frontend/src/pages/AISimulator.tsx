@@ -32,6 +32,14 @@ const mockOrderState = {
 
 import { v4 as uuidv4 } from 'uuid';
 
+// Shown while the bot is running a tool (from the /chat/stream tool_start events)
+const TOOL_LABELS: Record<string, string> = {
+  search_products: "Searching the catalog...",
+  place_cod_order: "Placing the order...",
+  update_delivery_address: "Updating the address...",
+  cancel_order: "Cancelling the order...",
+};
+
 const initialMessages: Message[] = [
   {
     role: "assistant",
@@ -88,6 +96,7 @@ const AISimulator = () => {
     return saved ? JSON.parse(saved) : mockOrderState;
   });
   const [isLoading, setIsLoading] = useState(false);
+  const [toolStatus, setToolStatus] = useState<string | null>(null);
   const [vectorResults, setVectorResults] = useState<{ name: string, score: number }[]>(() => {
     const saved = localStorage.getItem("ai_sim_vector");
     return saved ? JSON.parse(saved) : [];
@@ -132,7 +141,7 @@ const AISimulator = () => {
         reqBody.open_ai_key = customKey; // Pass down the custom key to backend for later once DB is ready
       }
 
-      const res = await fetch("http://localhost:8000/chat", {
+      const res = await fetch("http://localhost:8000/chat/stream", {
         method: "POST",
         headers: {
           "Content-Type": "application/json",
@@ -153,7 +162,47 @@ const AISimulator = () => {
         return;
       }
 
-      const data = await res.json();
+      // Server-Sent Events: tokens fill a live bubble, the final "done" event carries the full payload
+      const reader = res.body!.getReader();
+      const decoder = new TextDecoder();
+      let buffer = "";
+      let streamed = "";
+      let data: any = null;
+      setMessages((prev) => [...prev, { role: "assistant", content: "" }]);
+
+      while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        const frames = buffer.split("\n\n");
+        buffer = frames.pop() ?? "";
+
+        for (const frame of frames) {
+          const event = frame.match(/^event: (.*)$/m)?.[1];
+          const payload = frame.match(/^data: (.*)$/m)?.[1];
+          if (!event || !payload) continue;
+          const parsed = JSON.parse(payload);
+
+          if (event === "token") {
+            streamed += parsed.content;
+            setMessages((prev) => [...prev.slice(0, -1), { role: "assistant", content: streamed }]);
+          } else if (event === "tool_start") {
+            setToolStatus(TOOL_LABELS[parsed.name] ?? "Working...");
+          } else if (event === "tool_end") {
+            setToolStatus(null);
+          } else if (event === "done") {
+            data = parsed;
+          } else if (event === "error") {
+            throw new Error(parsed.detail);
+          }
+        }
+      }
+
+      if (!data) {
+        throw new Error("Stream ended before the reply was complete");
+      }
+      // Replace the live bubble with the final text and image bubbles below
+      setMessages((prev) => prev.slice(0, -1));
 
       if (data.search_results) {
         setVectorResults(data.search_results);
@@ -214,6 +263,11 @@ const AISimulator = () => {
 
     } catch (error) {
       console.error("Error sending message:", error);
+      // Drop the live bubble if nothing was streamed into it
+      setMessages((prev) => {
+        const last = prev[prev.length - 1];
+        return last && last.role === "assistant" && last.content === "" ? prev.slice(0, -1) : prev;
+      });
 
       // Mocking the trial expiry client side strictly for this specific UI task since backend DB is skipped:
       const customKey = localStorage.getItem("merchant_openai_key");
@@ -225,6 +279,7 @@ const AISimulator = () => {
       }
     } finally {
       setIsLoading(false);
+      setToolStatus(null);
     }
   };
 
@@ -331,6 +386,11 @@ const AISimulator = () => {
                 )}
               </motion.div>
             ))}
+            {isLoading && (
+              <p className="text-xs text-muted-foreground pl-10 animate-pulse">
+                {toolStatus ?? "Typing..."}
+              </p>
+            )}
           </div>
 
           <div className="p-4 border-t border-border">
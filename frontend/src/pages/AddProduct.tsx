@@ -30,6 +30,7 @@ const AddProduct = () => {
     const [skuPrefix, setSkuPrefix] = useState("");
     const [price, setPrice] = useState("");
     const [vendor, setVendor] = useState("");
+    const [productType, setProductType] = useState("");
     const [instock, setInstock] = useState("");
     const [description, setDescription] = useState("");
     const [inventoryPolicy, setInventoryPolicy] = useState("deny");
@@ -144,6 +145,7 @@ const AddProduct = () => {
                 sku_prefix: skuPrefix,
                 price: parseFloat(price),
                 vendor: vendor || undefined,
+                product_type: productType || undefined,
                 instock: parseInt(instock, 10),
                 description: description || undefined,
                 inventory_policy: inventoryPolicy,
@@ -386,6 +388,17 @@ const AddProduct = () => {
                                 />
                             </div>
 
+                            <div className="space-y-2">
+                                <Label htmlFor="producttype">Product Type</Label>
+                                <Input
+                                    id="producttype"
+                                    placeholder="e.g. Headphones"
+                                    value={productType}
+                                    onChange={(e) => setProductType(e.target.value)}
+                                    disabled={isSubmitting}
+                                />
+                            </div>
+
                             <div className="space-y-2 pt-2 border-t border-border">
                                 <Label htmlFor="skuprefix">SKU Generation <span className="text-destructive">*</span></Label>
                                 <p className="text-xs text-muted-foreground mb-2">
@@ -1,3 +1,4 @@
+import { useState } from "react";
 import { motion } from "framer-motion";
 import {
   ShoppingCart,
@@ -116,14 +117,22 @@ const MetricCard = ({
   </motion.div>
 );
 
+const TOP_WINDOWS = [
+  { value: "24h", label: "24h" },
+  { value: "7d", label: "7d" },
+  { value: "all", label: "All" },
+];
+
 const Dashboard = () => {
   const { getToken } = useAuth();
+  const [topWindow, setTopWindow] = useState("all");
 
   const { data: stats, isLoading } = useQuery({
-    queryKey: ['dashboard-stats'],
+    queryKey: ['dashboard-stats', topWindow],
+    placeholderData: (previous) => previous,
     queryFn: async () => {
       const token = await getToken();
-      const res = await fetch("http://localhost:8000/dashboard/stats", {
+      const res = await fetch(`http://localhost:8000/dashboard/stats?top_window=${topWindow}`, {
         headers: { "Authorization": `Bearer ${token}` }
       });
       if (!res.ok) throw new Error("Failed to fetch dashboard stats");
@@ -212,9 +221,26 @@ const Dashboard = () => {
           transition={{ delay: 0.5 }}
           className="glass-card rounded-xl p-5"
         >
-          <h3 className="text-sm font-semibold text-foreground mb-4">
-            Top Queried Products
-          </h3>
+          <div className="flex items-center justify-between mb-4">
+            <h3 className="text-sm font-semibold text-foreground">
+              Top Queried Products
+            </h3>
+            <div className="flex gap-1">
+              {TOP_WINDOWS.map((w) => (
+                <button
+                  key={w.value}
+                  onClick={() => setTopWindow(w.value)}
+                  className={`text-xs px-2 py-0.5 rounded-md transition-colors ${
+                    topWindow === w.value
+                      ? "bg-primary/20 text-primary"
+                      : "text-muted-foreground hover:text-foreground"
+                  }`}
+                >
+                  {w.label}
+                </button>
+              ))}
+            </div>
+          </div>
           <ResponsiveContainer width="100%" height={260}>
             <BarChart data={topProducts} layout="vertical">
               <CartesianGrid strokeDasharray="3 3" stroke="hsl(222 20% 16%)" />
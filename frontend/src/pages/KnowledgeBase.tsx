@@ -18,8 +18,17 @@ import { Input } from "@/components/ui/input";
 import { useAuth } from "@clerk/clerk-react";
 import { useToast } from "@/hooks/use-toast";
 import { useQuery, useMutation, useQueryClient } from "@tanstack/react-query";
+import { fetchAllPages } from "@/lib/auth-fetch";
 import { useNavigate } from "react-router-dom";
 
+const SYNC_PHASE_LABELS: Record<string, string> = {
+  uploading: "Uploading catalog...",
+  queued: "Waiting for an import worker...",
+  parsing: "Parsing CSV...",
+  importing: "Saving and vectorizing products...",
+  cleanup: "Removing stale products...",
+};
+
 const KnowledgeBase = () => {
   const { getToken } = useAuth();
   const { toast } = useToast();
@@ -30,6 +39,8 @@ const KnowledgeBase = () => {
   const [isDragging, setIsDragging] = useState(false);
   const [syncing, setSyncing] = useState(false);
   const [syncProgress, setSyncProgress] = useState(0);
+  const [syncPhase, setSyncPhase] = useState("uploading");
+  const [syncEta, setSyncEta] = useState<number | null>(null);
   const [processedCount, setProcessedCount] = useState<number | null>(null);
   const [searchQuery, setSearchQuery] = useState("");
 
@@ -39,14 +50,8 @@ const KnowledgeBase = () => {
   // 1. Fetch products using React Query
   const { data: products = [], isLoading: loadingProducts } = useQuery({
     queryKey: ['products'],
-    queryFn: async () => {
-      const token = await getToken();
-      const response = await fetch("http://localhost:8000/products", {
-        headers: { "Authorization": `Bearer ${token}` }
-      });
-      if (!response.ok) throw new Error("Failed to fetch products");
-      return (await response.json()) as any[];
-    },
+    // /products is paginated (200 per page), follow the cursor so the table and search cover the whole catalog
+    queryFn: () => fetchAllPages<any>("http://localhost:8000/products", getToken),
     staleTime: 1000 * 60 * 5, // Cache for 5 minutes
   });
 
@@ -127,7 +132,8 @@ const KnowledgeBase = () => {
 
     setFile(uploadedFile);
     setSyncing(true);
-    setSyncProgress(25); // Start artificial progress for visual feedback
+    setSyncProgress(0);
+    setSyncPhase("uploading");
     setProcessedCount(null);
 
     try {
@@ -136,8 +142,6 @@ const KnowledgeBase = () => {
       const formData = new FormData();
       formData.append("file", uploadedFile);
 
-      setSyncProgress(50);
-
       const response = await fetch("http://localhost:8000/upload-catalog", {
         method: "POST",
         headers: {
@@ -146,20 +150,40 @@ const KnowledgeBase = () => {
         body: formData,
       });
 
-      setSyncProgress(90);
-
       const data = await response.json();
 
       if (!response.ok) {
         throw new Error(data.detail || "Upload failed");
       }
 
-      setProcessedCount(data.processed_variants);
+      // The import runs as a background job on the server, poll it until it finishes
+      let job = data;
+      while (job.status === "queued" || job.status === "running") {
+        await new Promise((resolve) => setTimeout(resolve, 1000));
+        const jobResponse = await fetch(`http://localhost:8000/upload-catalog/${data.job_id}`, {
+          headers: {
+            "Authorization": `Bearer ${await getToken()}`
+          }
+        });
+        job = await jobResponse.json();
+        if (!jobResponse.ok) {
+          throw new Error(job.detail || "Lost track of the upload job");
+        }
+        setSyncProgress(job.percent);
+        setSyncPhase(job.phase);
+        setSyncEta(job.eta_seconds);
+      }
+
+      if (job.status === "failed") {
+        throw new Error(job.error || "Upload failed");
+      }
+
+      setProcessedCount(job.result.processed);
       setSyncProgress(100);
 
       toast({
         title: "Upload Successful",
-        description: `Successfully processed ${data.processed_variants} product variants into your AI Knowledge Engine.`,
+        description: `Successfully processed ${job.result.processed} product variants into your AI Knowledge Engine.`,
       });
 
       queryClient.invalidateQueries({ queryKey: ['products'] });
@@ -183,6 +207,7 @@ const KnowledgeBase = () => {
       setFile(null); // Reset UI
     } finally {
       setSyncing(false);
+      setSyncEta(null);
     }
   };
 
@@ -341,9 +366,11 @@ const KnowledgeBase = () => {
                 <div className="flex items-center justify-between text-xs">
                   <span className="text-muted-foreground flex items-center gap-2">
                     <RefreshCw className="h-3 w-3 animate-spin" />
-                    Uploading and Vectorizing Data...
+                    {SYNC_PHASE_LABELS[syncPhase] ?? "Uploading and Vectorizing Data..."}
+                  </span>
+                  <span className="text-primary font-medium">
+                    {syncProgress}%{syncEta !== null && ` · ~${Math.ceil(syncEta)}s left`}
                   </span>
-                  <span className="text-primary font-medium">{syncProgress}%</span>
                 </div>
                 <Progress value={syncProgress} className="h-2" />
               </div>
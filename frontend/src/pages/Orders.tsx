@@ -5,6 +5,7 @@ import { Button } from "@/components/ui/button";
 import { toast } from "@/hooks/use-toast";
 import { useAuth } from "@clerk/clerk-react";
 import { useQuery, useMutation, useQueryClient } from "@tanstack/react-query";
+import { fetchAllPages } from "@/lib/auth-fetch";
 
 type OrderStatus = "Pending" | "Confirmed" | "Shipped" | "Cancelled";
 
@@ -49,14 +50,8 @@ const Orders = () => {
   // 1. Fetch orders using React Query
   const { data: orders = [], isLoading } = useQuery({
     queryKey: ['orders'],
-    queryFn: async () => {
-      const token = await getToken();
-      const res = await fetch("http://localhost:8000/orders", {
-        headers: { "Authorization": `Bearer ${token}` }
-      });
-      if (!res.ok) throw new Error("Failed to fetch orders");
-      return (await res.json()) as OrderData[];
-    },
+    // /orders is paginated (100 per page), follow the cursor so search, filters and export see every order
+    queryFn: () => fetchAllPages<OrderData>("http://localhost:8000/orders", getToken),
     staleTime: 1000 * 60 * 5, // Cache data for 5 minutes without re-fetching
   });
 